@@ -1,79 +1,202 @@
 import os
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_file, send_from_directory, g
 from werkzeug.utils import secure_filename
-import re
 import json
-import threading
+import gzip
+import time
 import uuid
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
-# from utils import get_pdf_vector, create_qa_chain 
-# from utils import parse_json
-import google.generativeai as genai
-from PyPDF2 import PdfReader
+from utils import parse_json
+from utils import PdfTextCache, ResponseCache, ChunkIndex, BM25Scorer, get_pdf_vector, split_component_dict, merge_relations
+from utils import file_sha256, evict_lru, FileListing, ContentStore
+from utils import estimate_tokens, budget_chunks, merge_partonomies
+from convert_json_to_imf import convert_to_file
+from jobs import JobQueue, make_status_store
+from llm import make_client, generate_with_retry, map_concurrently
+from metrics import Metrics
 
 # Load environment variables from .env file
 load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Uploaded PDFs by content; uploads/<filename> are links into it
+app.config['UPLOAD_STORE_FOLDER'] = os.path.join('uploads', 'by_hash')
 app.config['VECTOR_STORE_FOLDER'] = 'vector_store'
 app.config['PROCESSED_DATA_FOLDER'] = 'processed_data'
+app.config['TEXT_CACHE_FOLDER'] = 'text_cache'
+app.config['TEXT_CACHE_MAX_BYTES'] = int(os.getenv('TEXT_CACHE_MAX_MB', '512')) * 1024 * 1024
+app.config['PDF_EXTRACT_WORKERS'] = int(os.getenv('PDF_EXTRACT_WORKERS', '1'))
 app.config['ALLOWED_EXTENSIONS'] = {'pdf'}
+# Documents shorter than this are sent to /chat whole; longer ones are searched by chunk
+app.config['CHAT_FULL_DOCUMENT_MAX_CHARS'] = int(os.getenv('CHAT_FULL_DOCUMENT_MAX_CHARS', '30000'))
+app.config['RETRIEVAL_TOP_K'] = int(os.getenv('RETRIEVAL_TOP_K', '8'))
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '2'))
+app.config['JOB_QUEUE_SIZE'] = int(os.getenv('JOB_QUEUE_SIZE', '20'))
+# 'memory' is per process; use 'sqlite' when running several worker processes
+app.config['STATUS_BACKEND'] = os.getenv('STATUS_BACKEND', 'memory')
+app.config['STATUS_DB'] = os.getenv('STATUS_DB', 'task_status.db')
+app.config['STATUS_TTL'] = int(os.getenv('STATUS_TTL', str(24 * 3600)))
+app.config['STATUS_MAX_ENTRIES'] = int(os.getenv('STATUS_MAX_ENTRIES', '10000'))
+app.config['STATUS_STREAM_TIMEOUT'] = int(os.getenv('STATUS_STREAM_TIMEOUT', '3600'))
+# 'gemini', or 'fake' for offline testing and benchmarks (see FakeClient)
+app.config['LLM_BACKEND'] = os.getenv('LLM_BACKEND', 'gemini')
+app.config['LLM_MODEL'] = os.getenv('LLM_MODEL', 'gemini-2.5-pro')
+app.config['FAKE_LLM_LATENCY'] = float(os.getenv('FAKE_LLM_LATENCY', '0'))
+app.config['FAKE_LLM_RESPONSE_CHARS'] = int(os.getenv('FAKE_LLM_RESPONSE_CHARS', '2000'))
+app.config['LLM_CONCURRENCY'] = int(os.getenv('LLM_CONCURRENCY', '4'))
+app.config['EXTRACTION_CHUNK_TOKENS'] = int(os.getenv('EXTRACTION_CHUNK_TOKENS', '200000'))
+app.config['LLM_RETRIES'] = int(os.getenv('LLM_RETRIES', '3'))
+app.config['LLM_CACHE_FOLDER'] = 'llm_cache'
+app.config['LLM_CACHE_MAX_BYTES'] = int(os.getenv('LLM_CACHE_MAX_MB', '256')) * 1024 * 1024
+app.config['IMF_CACHE_FOLDER'] = 'imf_cache'
+app.config['IMF_CACHE_MAX_BYTES'] = int(os.getenv('IMF_CACHE_MAX_MB', '1024')) * 1024 * 1024
+app.config['IMF_WORKERS'] = int(os.getenv('IMF_WORKERS', '2'))
+# How long /get_imf waits for a conversion before answering 202 and letting the client retry
+app.config['IMF_WAIT_SECONDS'] = float(os.getenv('IMF_WAIT_SECONDS', '20'))
+app.config['PROCESSED_FILES_PAGE_SIZE'] = int(os.getenv('PROCESSED_FILES_PAGE_SIZE', '100'))
+
+# Bump these whenever the corresponding prompt changes, so cached responses are not reused
+PARTONOMY_PROMPT_VERSION = 'partonomy-1'
+RELATIONS_PROMPT_VERSION = 'relations-1'
+CHAT_PROMPT_VERSION = 'chat-1'
+# Bump whenever convert_json_to_imf output changes, so cached IMF files are not reused
+IMF_CONVERTER_VERSION = 'imf-1'
 
 # Ensure upload and vector store directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['VECTOR_STORE_FOLDER'], exist_ok=True)
 os.makedirs(app.config['PROCESSED_DATA_FOLDER'], exist_ok=True)
-
-# Global dictionary to store task status
-task_status = {}
-
-def parse_json(results_string):
-    cleaned_string = results_string.replace('\n', '')
-    # matches a closing quote followed by a closing brace or bracket, followed by an opening quote (indicating missing comma)
-    json_string = re.sub(r'"\s*([\]}])\s*"', r'"\1,""', cleaned_string)
-    # Add commas after objects and arrays if not followed by a comma or end of object/array
-    json_string = re.sub(r'([\]}])\s*([^\],})\s*\n])', r'\1,\2', json_string)
-    # Remove trailing commas before closing braces
-    json_string = re.sub(r',\s*}', '}', json_string)
-    match = re.search(r'\{.*\}', json_string, re.DOTALL)
-    if match:
-        content = match.group(0)
-        # print(content)
-    else:
-        print("No content found between curly braces.")
-    
+os.makedirs(app.config['IMF_CACHE_FOLDER'], exist_ok=True)
+
+# Extracted PDF text, shared by process_pdf_task and /chat
+text_cache = PdfTextCache(app.config['TEXT_CACHE_FOLDER'], app.config['TEXT_CACHE_MAX_BYTES'],
+                          app.config['PDF_EXTRACT_WORKERS'])
+
+# Uploaded PDFs, stored once per content
+upload_store = ContentStore(app.config['UPLOAD_STORE_FOLDER'])
+upload_lock = threading.Lock()
+
+# Processed JSON files shown in the UI, listed again only when the folder changes
+processed_files = FileListing(app.config['PROCESSED_DATA_FOLDER'])
+
+# Model used for both document extraction and chat
+llm_client = make_client(app.config['LLM_BACKEND'],
+                         app.config['LLM_MODEL'] if app.config['LLM_BACKEND'] == 'gemini' else None,
+                         app.config['FAKE_LLM_LATENCY'], app.config['FAKE_LLM_RESPONSE_CHARS'])
+response_cache = ResponseCache(app.config['LLM_CACHE_FOLDER'], app.config['LLM_CACHE_MAX_BYTES'])
+
+# Task status, by task_id
+task_status = make_status_store(app.config['STATUS_BACKEND'], app.config['STATUS_DB'],
+                                app.config['STATUS_TTL'], app.config['STATUS_MAX_ENTRIES'])
+
+# Uploads are processed by a fixed number of workers; excess jobs wait in a bounded queue
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_SIZE'])
+
+# IMF conversions run in worker processes; requests for the same source share one conversion
+imf_pool = ProcessPoolExecutor(max_workers=app.config['IMF_WORKERS'])
+imf_pending = {}  # cache key -> Future
+imf_lock = threading.Lock()
+source_digests = {}  # json path -> ((mtime_ns, size), sha256)
+
+# Metrics of this process, served on /metrics
+metrics = Metrics('imf_')
+metrics.describe('stage_seconds', 'histogram', 'Duration of each stage of upload processing and chat.')
+metrics.describe('task_seconds', 'histogram', 'Duration of process_pdf_task by outcome.')
+metrics.describe('tasks_total', 'counter', 'Finished upload tasks by outcome.')
+metrics.describe('task_errors_total', 'counter', 'Failed upload tasks by stage and exception type.')
+metrics.describe('uploads_total', 'counter', 'Uploads by result (new, reused, in_progress, rejected).')
+metrics.describe('llm_request_seconds', 'histogram', 'Duration of model requests by prompt, including retries.')
+metrics.describe('llm_prompt_chars_total', 'counter', 'Characters sent to the model by prompt.')
+metrics.describe('llm_response_chars_total', 'counter', 'Characters received from the model by prompt.')
+metrics.describe('response_cache_hits_total', 'counter', 'Model responses served from the response cache.')
+metrics.describe('response_cache_misses_total', 'counter', 'Model responses not found in the response cache.')
+metrics.describe('text_cache_hits_total', 'counter', 'PDF texts served from the text cache.')
+metrics.describe('text_cache_misses_total', 'counter', 'PDF texts extracted because they were not cached.')
+metrics.describe('downloads_total', 'counter', 'IMF downloads by result (hit, miss, not_modified, pending).')
+metrics.describe('job_queue_depth', 'gauge', 'Uploads waiting for a worker.')
+metrics.describe('jobs_running', 'gauge', 'Uploads being processed.')
+metrics.describe('http_request_seconds', 'histogram', 'Time to produce a response (not to stream it), by endpoint.')
+metrics.describe('http_requests_total', 'counter', 'Responses by endpoint and status code.')
+metrics.gauge_callback('response_cache_hits_total', lambda: response_cache.stats()['hits'])
+metrics.gauge_callback('response_cache_misses_total', lambda: response_cache.stats()['misses'])
+metrics.gauge_callback('text_cache_hits_total', lambda: text_cache.stats()['hits'])
+metrics.gauge_callback('text_cache_misses_total', lambda: text_cache.stats()['misses'])
+metrics.gauge_callback('job_queue_depth', job_queue.depth)
+metrics.gauge_callback('jobs_running', job_queue.running)
+
+def cached_extract(prompt, template_version, doc_hash, question='', timings=None):
+    """
+    The JSON object in the model's response to an extraction prompt, or {}.
+    Only responses that contain an object are cached, so a truncated or
+    garbled answer is asked again next time instead of being replayed.
+    """
+    key = response_cache.key(llm_client.model_name, template_version, doc_hash, question)
+    response = response_cache.get(key)
+    if response is not None:
+        with metrics.timer('stage_seconds', timings, stage='parse_json'):
+            result = parse_json(response)
+        if result:
+            return result
+    with metrics.timer('llm_request_seconds', prompt=template_version):
+        response = generate_with_retry(llm_client, prompt, app.config['LLM_RETRIES'])
+    metrics.inc('llm_prompt_chars_total', len(prompt), prompt=template_version)
+    metrics.inc('llm_response_chars_total', len(response), prompt=template_version)
+    with metrics.timer('stage_seconds', timings, stage='parse_json'):
+        result = parse_json(response)
+    if result:
+        response_cache.put(key, response)
+    return result
+
+def vector_index_path(digest):
+    return os.path.join(app.config['VECTOR_STORE_FOLDER'], digest + '.json')
+
+@lru_cache(maxsize=8)
+def load_chat_index(doc_hash, mtime_ns):
+    """Saved chunk index of a document, parsed once per file version."""
+    return ChunkIndex.load(vector_index_path(doc_hash), BM25Scorer())
+
+def chat_index(pages, doc_hash):
+    # Large manuals have indexes of several MB; keep the recently asked ones parsed
+    index_path = vector_index_path(doc_hash)
     try:
-        res_dict = json.loads(content)
-        return res_dict
-    except json.JSONDecodeError as e:
-        if "Expecting ',' delimiter" in str(e):
-            print(f"JSON error detected: {e}")
-            # Attempt to fix the JSON by adding a closing bracket
-            fixed_json_string = content.rstrip() + '}'
-            try:
-                # Try to load the fixed JSON string
-                res_dict = json.loads(fixed_json_string)
-                print("JSON was fixed and is now valid")
-                return res_dict
-            except json.JSONDecodeError as e:
-                print(f"JSON format error after attempting to fix: {e}")
-                return None
-        else:
-            print(f"JSON format error: {e}")
-        return {}
+        index = load_chat_index(doc_hash, os.stat(index_path).st_mtime_ns)
+    except OSError:
+        index = None
+    return index or get_pdf_vector(pages, index_path)
 
 def process_pdf_task(task_id, pdf_path, filename, processed_folder):
+    # The task may have been cancelled through another worker process while queued
+    if task_status.get(task_id, {}).get('status') == 'cancelled':
+        return
+    # Seconds per stage, reported in the final status and on /metrics
+    timings = {}
+    current = {'stage': 'start'}
+    started = time.perf_counter()
+
+    def stage(name):
+        current['stage'] = name
+        return metrics.timer('stage_seconds', timings, stage=name)
+
     try:
         task_status[task_id] = {'status': 'processing', 'progress': 5, 'message': 'Extracting text...'}
-        
-        # Extract text from the saved PDF
-        pdf_text = ""
-        with open(pdf_path, 'rb') as f:
-            reader = PdfReader(f)
-            for page in reader.pages:
-                pdf_text += page.extract_text() or ""
+
+        def extraction_progress(done, total):
+            task_status[task_id] = {'status': 'processing', 'progress': 5 + int(20 * done / total),
+                                    'message': f'Extracting text (page {done}/{total})...'}
+
+        # Extract text from the saved PDF (cached for later /chat calls)
+        with stage('extract_text'):
+            pages = text_cache.get_pages(pdf_path, extraction_progress)
+            pdf_text = "".join(pages)
+            doc_hash = text_cache.digest(pdf_path)
+        # Build the chunk index used by /chat while the pages are at hand
+        with stage('build_index'):
+            get_pdf_vector(pages, vector_index_path(doc_hash))
 
         task_status[task_id] = {'status': 'processing', 'progress': 25, 'message': 'Identifying components...'}
 
@@ -94,15 +217,35 @@ def process_pdf_task(task_id, pdf_path, filename, processed_folder):
                 }}
             }}
             ```"""
+        # Documents over the token budget are read in chunks: a partial
+        # partonomy per chunk, merged by tagID
+        chunk_tokens = app.config['EXTRACTION_CHUNK_TOKENS']
+        if estimate_tokens(pdf_text) > chunk_tokens:
+            documents = budget_chunks(pages, chunk_tokens)
+        else:
+            documents = [pdf_text]
+
+        def chunk_key(i):
+            if len(documents) == 1:
+                return ''
+            return f"chunk {i + 1}/{len(documents)} of {chunk_tokens} tokens"
+
+        def partonomy_for(i):
+            full_prompt_part = f"Document:\n\"\"\"\n{documents[i]}\n\"\"\"\n\nInstructions:\n{extraction_prompt}"
+            return cached_extract(full_prompt_part, PARTONOMY_PROMPT_VERSION, doc_hash, chunk_key(i), timings)
+
         # 3. save Partonomy result
-        full_prompt_part = f"Document:\n\"\"\"\n{pdf_text}\n\"\"\"\n\nInstructions:\n{extraction_prompt}"
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        response = model.generate_content(full_prompt_part)
-        component_dict = parse_json(response.text)
+        with stage('partonomy_llm'):
+            partonomies = map_concurrently(partonomy_for, range(len(documents)), app.config['LLM_CONCURRENCY'])
+        with stage('merge_json'):
+            if len(documents) == 1:
+                component_dict = partonomies[0]
+            else:
+                component_dict = merge_partonomies(partonomies)
 
         json_filename_comp = os.path.splitext(filename)[0] + '_components.json'
         json_path_comp = os.path.join(processed_folder, json_filename_comp)
-        with open(json_path_comp, 'w') as f:
+        with stage('write_files'), open(json_path_comp, 'w') as f:
             json.dump(component_dict, f, indent=4)
 
         task_status[task_id] = {'status': 'processing', 'progress': 60, 'message': 'Constructing information model...'}
@@ -135,19 +278,70 @@ def process_pdf_task(task_id, pdf_path, filename, processed_folder):
             }}
 
             """
-        full_prompt_func = f"Document:\n\"\"\"\n{pdf_text}\n\"\"\"\n\component_dict:\n{component_dict}\n\nInstructions:\n{func_prompt}"
-        response = model.generate_content(full_prompt_func)
-        res = response.text
-        result_dict = parse_json(res)
+        # One request per top-level component (plus the system itself) and per
+        # chunk of the document, run concurrently
+        def relations_progress(done, total):
+            task_status[task_id] = {'status': 'processing', 'progress': 60 + int(35 * done / total),
+                                    'message': f'Constructing information model ({done}/{total})...'}
+
+        def relations_for(job):
+            i, part = job
+            full_prompt_func = f"Document:\n\"\"\"\n{documents[i]}\n\"\"\"\n\component_dict:\n{part}\n\nInstructions:\n{func_prompt}"
+            question = json.dumps(part, sort_keys=True)
+            if chunk_key(i):
+                question = chunk_key(i) + "\n" + question
+            return cached_extract(full_prompt_func, RELATIONS_PROMPT_VERSION, doc_hash, question, timings)
+
+        jobs = [(i, part) for i in range(len(documents)) for part in split_component_dict(component_dict)]
+        with stage('relations_llm'):
+            relations = map_concurrently(relations_for, jobs, app.config['LLM_CONCURRENCY'], relations_progress)
+        with stage('merge_json'):
+            result_dict = merge_relations(relations, by_tag=len(documents) > 1)
 
         json_filename = os.path.splitext(filename)[0] + '.json'
         json_path = os.path.join(processed_folder, json_filename)
-        with open(json_path, 'w') as f:
+        with stage('write_files'), open(json_path, 'w') as f:
             json.dump(result_dict, f, indent=4)
-
-        task_status[task_id] = {'status': 'completed', 'progress': 100, 'message': 'Processing complete!', 'processed_file': json_filename}
+        processed_files.invalidate()
+        if result_dict:
+            # Only a usable model is worth reusing for later uploads of the same content
+            upload_store.set_meta(doc_hash, processed_file=json_filename, model=llm_client.model_name,
+                                  prompts=[PARTONOMY_PROMPT_VERSION, RELATIONS_PROMPT_VERSION])
+
+        elapsed = time.perf_counter() - started
+        metrics.observe('task_seconds', elapsed, status='completed')
+        metrics.inc('tasks_total', status='completed')
+        task_status[task_id] = {'status': 'completed', 'progress': 100, 'message': 'Processing complete!',
+                                'processed_file': json_filename,
+                                'metrics': {'seconds': round(elapsed, 4), 'stages': timings, 'pages': len(pages),
+                                            'document_chars': len(pdf_text), 'chunks': len(documents),
+                                            'components': len(result_dict),
+                                            'llm_requests': len(relations) + len(partonomies)}}
     except Exception as e:
-        task_status[task_id] = {'status': 'error', 'message': str(e)}
+        elapsed = time.perf_counter() - started
+        metrics.observe('task_seconds', elapsed, status='error')
+        metrics.inc('tasks_total', status='error')
+        metrics.inc('task_errors_total', stage=current['stage'], error_type=type(e).__name__)
+        task_status[task_id] = {'status': 'error', 'message': str(e), 'stage': current['stage'],
+                                'error_type': type(e).__name__,
+                                'metrics': {'seconds': round(elapsed, 4), 'stages': timings}}
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unknown'
+    if 'request_started' in g:
+        metrics.observe('http_request_seconds', time.perf_counter() - g.request_started, endpoint=endpoint)
+    metrics.inc('http_requests_total', endpoint=endpoint, status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_route():
+    # Prometheus text format; each worker process reports its own values
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -155,12 +349,18 @@ def allowed_file(filename):
 
 @app.route('/')
 def index():
-    # List available processed JSON files to potentially display in the UI
-    processed_files = []
-    for f in os.listdir(app.config['PROCESSED_DATA_FOLDER']):
-        if f.endswith('.json'):
-            processed_files.append(f)
-    return render_template('index.html', processed_files=processed_files)
+    # Only the first page of processed files; the page fetches more from /processed_files
+    page_size = app.config['PROCESSED_FILES_PAGE_SIZE']
+    total, first_page = processed_files.page(0, page_size)
+    return render_template('index.html', processed_files=first_page, processed_total=total,
+                           page_size=page_size)
+
+@app.route('/processed_files')
+def list_processed_files():
+    offset = max(0, request.args.get('offset', default=0, type=int))
+    limit = min(max(1, request.args.get('limit', default=app.config['PROCESSED_FILES_PAGE_SIZE'], type=int)), 1000)
+    total, names = processed_files.page(offset, limit, request.args.get('q', ''))
+    return jsonify({'total': total, 'offset': offset, 'limit': limit, 'files': names})
 
 
 @app.route('/upload', methods=['POST'])
@@ -173,20 +373,119 @@ def upload_file():
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
         pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(pdf_path)
-
-        task_id = str(uuid.uuid4())
-        thread = threading.Thread(target=process_pdf_task, args=(task_id, pdf_path, filename, app.config['PROCESSED_DATA_FOLDER']))
-        thread.start()
+        # Stream to the content store while hashing, under a staging name; the
+        # upload only replaces pdf_path once it is reused or accepted, so a
+        # rejected upload leaves the name and its processed model matching
+        staged_path = os.path.join(app.config['UPLOAD_FOLDER'], f".{filename}.{uuid.uuid4().hex}.upload")
+        digest = upload_store.save(file.stream, staged_path)
+
+        def install():
+            previous = text_cache.digest(pdf_path) if os.path.exists(pdf_path) else None
+            if previous == digest:
+                os.remove(staged_path)
+                return
+            os.replace(staged_path, pdf_path)
+            text_cache.remember_digest(pdf_path, digest)
+            if previous is not None:
+                # Drop the old bytes unless another name still uses them
+                upload_store.release(previous)
+
+        try:
+            with upload_lock:
+                task_id = str(uuid.uuid4())
+                processed_file = reusable_processed_file(digest)
+                if processed_file is not None:
+                    # Same content processed before, under this or another name
+                    install()
+                    task_status[task_id] = {'status': 'completed', 'progress': 100, 'processed_file': processed_file,
+                                            'message': 'Already processed, reusing the results.'}
+                    metrics.inc('uploads_total', result='reused')
+                    return jsonify({'task_id': task_id, 'reused': True}), 202
+
+                running_id = upload_store.get_meta(digest).get('task_id')
+                if task_status.get(running_id, {}).get('status') in ('queued', 'processing'):
+                    install()
+                    metrics.inc('uploads_total', result='in_progress')
+                    return jsonify({'task_id': running_id, 'reused': True}), 202
+
+                # Jobs are only submitted under upload_lock, so the queue cannot fill up after this check
+                if job_queue.full():
+                    metrics.inc('uploads_total', result='rejected')
+                    response = jsonify({'error': 'Server is busy processing other files, please try again later.'})
+                    response.headers['Retry-After'] = '30'
+                    return response, 503
+                install()
+                task_status[task_id] = {'status': 'queued', 'progress': 0, 'message': 'Waiting for a free worker...'}
+                job_queue.submit(task_id, process_pdf_task, task_id, pdf_path, filename, app.config['PROCESSED_DATA_FOLDER'])
+                upload_store.set_meta(digest, task_id=task_id)
+                metrics.inc('uploads_total', result='new')
+        finally:
+            if os.path.exists(staged_path):
+                # Not installed: rejected, or failed
+                os.remove(staged_path)
+                upload_store.release(digest)
 
         return jsonify({'task_id': task_id}), 202
 
     return jsonify({'error': 'File type not allowed'}), 400
 
+def reusable_processed_file(digest):
+    """
+    The processed JSON made from a PDF with this content by the current model
+    and prompts, if it still exists and its PDF has not been replaced since.
+    """
+    meta = upload_store.get_meta(digest)
+    processed_file = meta.get('processed_file')
+    if not processed_file or meta.get('model') != llm_client.model_name \
+            or meta.get('prompts') != [PARTONOMY_PROMPT_VERSION, RELATIONS_PROMPT_VERSION]:
+        return None
+    json_path = os.path.join(app.config['PROCESSED_DATA_FOLDER'], processed_file)
+    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.splitext(processed_file)[0] + '.pdf')
+    if not os.path.exists(json_path) or not os.path.exists(pdf_path) or text_cache.digest(pdf_path) != digest:
+        return None
+    return processed_file
+
+def status_payload(task_id):
+    status = dict(task_status.get(task_id, {'status': 'not_found'}))
+    if status['status'] == 'queued':
+        # Only known when the task is queued in this process
+        status['position'] = job_queue.position(task_id)
+    return status
+
 @app.route('/status/<task_id>')
 def task_status_route(task_id):
-    status = task_status.get(task_id, {'status': 'not_found'})
-    return jsonify(status)
+    return jsonify(status_payload(task_id))
+
+@app.route('/status/<task_id>/events')
+def task_status_events(task_id):
+    # Server-Sent Events: push every status change until the task finishes
+    def stream():
+        last = None
+        last_sent = time.time()
+        deadline = time.time() + app.config['STATUS_STREAM_TIMEOUT']
+        while time.time() < deadline:
+            status = status_payload(task_id)
+            if status != last:
+                last = status
+                last_sent = time.time()
+                yield f"data: {json.dumps(status)}\n\n"
+                if status['status'] in ('completed', 'error', 'cancelled', 'not_found'):
+                    return
+            elif time.time() - last_sent > 15:
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+            task_status.wait_for_update(5)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    queued_here = job_queue.cancel(task_id)
+    if not queued_here and task_status.get(task_id, {}).get('status') != 'queued':
+        return jsonify({'error': 'Task is not queued and cannot be cancelled.'}), 409
+    task_status[task_id] = {'status': 'cancelled', 'message': 'Processing cancelled.'}
+    return jsonify(task_status[task_id])
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -209,21 +508,199 @@ def chat():
         return jsonify({'error': f'File "{pdf_filename}" not found. Please upload it first.'}), 404
 
     try:
-        # Use PdfReader to extract text directly from the PDF file
-        pdf_text = ""
-        reader = PdfReader(pdf_path)
-        for page in reader.pages:
-            pdf_text += page.extract_text() or ""
-
-        # Create prompt for Gemini
-        prompt = f"Based on the following document, please answer the question and provide the citation.\n\nDocument:\n\"\"\"\n{pdf_text}\n\"\"\"\n\nQuestion: {question}\n\nAnswer:"
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        response = model.generate_content(prompt)
-
-        return jsonify({'answer': response.text})
+        # Reuse the text extracted at upload time; only parse the PDF on a cache miss
+        with metrics.timer('stage_seconds', stage='chat_load_text'):
+            pages = text_cache.get_pages(pdf_path)
+            pdf_text = "".join(pages)
+            doc_hash = text_cache.digest(pdf_path)
+        cache_key = response_cache.key(llm_client.model_name, CHAT_PROMPT_VERSION, doc_hash, question)
+        cached_answer = response_cache.get(cache_key)
+
+        if cached_answer is None:
+            if len(pdf_text) > app.config['CHAT_FULL_DOCUMENT_MAX_CHARS']:
+                # Only send the chunks relevant to the question
+                with metrics.timer('stage_seconds', stage='chat_retrieval'):
+                    index = chat_index(pages, doc_hash)
+                    chunks = index.search(question, app.config['RETRIEVAL_TOP_K'])
+                pdf_text = "\n\n".join(f"[page {c['page']}]\n{c['text']}" for c in chunks)
+
+            # Create prompt for Gemini
+            prompt = f"Based on the following document, please answer the question and provide the citation.\n\nDocument:\n\"\"\"\n{pdf_text}\n\"\"\"\n\nQuestion: {question}\n\nAnswer:"
+
+        if data.get('stream'):
+            # Send the answer as plain text, chunk by chunk, as the model produces it
+            def generate():
+                if cached_answer is not None:
+                    yield cached_answer
+                    return
+                pieces = []
+                started = time.perf_counter()
+                try:
+                    for piece in llm_client.stream(prompt):
+                        pieces.append(piece)
+                        yield piece
+                except Exception as e:
+                    yield f"\n\n[Error during question answering: {str(e)}]"
+                    return
+                answer = "".join(pieces)
+                metrics.observe('llm_request_seconds', time.perf_counter() - started, prompt=CHAT_PROMPT_VERSION)
+                metrics.inc('llm_prompt_chars_total', len(prompt), prompt=CHAT_PROMPT_VERSION)
+                metrics.inc('llm_response_chars_total', len(answer), prompt=CHAT_PROMPT_VERSION)
+                response_cache.put(cache_key, answer)
+
+            return Response(generate(), mimetype='text/plain',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        answer = cached_answer
+        if answer is None:
+            with metrics.timer('llm_request_seconds', prompt=CHAT_PROMPT_VERSION):
+                answer = llm_client.generate(prompt)
+            metrics.inc('llm_prompt_chars_total', len(prompt), prompt=CHAT_PROMPT_VERSION)
+            metrics.inc('llm_response_chars_total', len(answer), prompt=CHAT_PROMPT_VERSION)
+            response_cache.put(cache_key, answer)
+        return jsonify({'answer': answer})
     except Exception as e:
         return jsonify({'error': f'Error during question answering: {str(e)}'}), 500
 
+def source_digest(path):
+    # Only hash a processed file again when it changed on disk
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = source_digests.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, file_sha256(path))
+        source_digests[path] = cached
+    return cached[1]
+
+def imf_conversion(json_path, imf_path, key):
+    """Future of the conversion of json_path to imf_path, started unless already running."""
+    with imf_lock:
+        future = imf_pending.get(key)
+        if future is not None:
+            return future
+        future = imf_pool.submit(convert_to_file, json_path, imf_path, True, True)
+        imf_pending[key] = future
+
+    def finished(done):
+        with imf_lock:
+            if imf_pending.get(key) is done:
+                del imf_pending[key]
+        evict_lru(app.config['IMF_CACHE_FOLDER'], app.config['IMF_CACHE_MAX_BYTES'], '.imf.gz')
+
+    # Outside the lock: a future that is already done runs the callback right away
+    future.add_done_callback(finished)
+    return future
+
+# Serve the IMF file of a processed JSON, converted on first request and then cached
+@app.route('/get_imf/<filename>')
+def get_imf(filename):
+    filename = secure_filename(filename)
+    json_path = os.path.join(app.config['PROCESSED_DATA_FOLDER'], filename)
+    if not os.path.exists(json_path):
+        return jsonify({'error': 'Processed data file not found.'}), 404
+
+    # The cached file is gzip-compressed; send it as is to clients that accept gzip
+    key = hashlib.sha256(f"{IMF_CONVERTER_VERSION}:{source_digest(json_path)}".encode('utf-8')).hexdigest()
+    send_gzip = request.accept_encodings['gzip'] > 0
+    etag = key + ('-gzip' if send_gzip else '')
+    if request.if_none_match.contains(etag):
+        metrics.inc('downloads_total', result='not_modified')
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    imf_path = os.path.join(app.config['IMF_CACHE_FOLDER'], key + '.imf.gz')
+    try:
+        f = open(imf_path, 'rb')
+        metrics.inc('downloads_total', result='hit')
+    except FileNotFoundError:
+        metrics.inc('downloads_total', result='miss')
+        try:
+            imf_conversion(json_path, imf_path, key).result(timeout=app.config['IMF_WAIT_SECONDS'])
+            f = open(imf_path, 'rb')
+        except FutureTimeoutError:
+            metrics.inc('downloads_total', result='pending')
+            response = jsonify({'status': 'converting', 'message': 'The IMF file is being generated, please retry.'})
+            response.headers['Retry-After'] = '2'
+            return response, 202
+        except Exception as e:
+            return jsonify({'error': f'Error converting to IMF: {str(e)}'}), 500
+    try:
+        os.utime(imf_path)  # recently served files are the last to be evicted
+    except OSError:
+        pass
+
+    download_name = os.path.splitext(filename)[0] + '.imf'
+    if send_gzip:
+        response = send_file(f, mimetype='application/json', as_attachment=True,
+                             download_name=download_name, etag=False)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_file(gzip.GzipFile(fileobj=f), mimetype='application/json', as_attachment=True,
+                             download_name=download_name, etag=False)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@lru_cache(maxsize=8)
+def load_processed_model(json_path, mtime_ns):
+    """
+    Parsed processed JSON with its children index, cached per file version.
+    Components whose parent is missing are listed with the roots so every
+    component can be reached.
+    """
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    children = {}
+    roots = []
+    for name, details in data.items():
+        part_of = details.get('partOf') if isinstance(details, dict) else None
+        parent = part_of[0] if part_of else None
+        if parent in data and parent != name:
+            children.setdefault(parent, []).append(name)
+        else:
+            roots.append(name)
+    return data, children, roots
+
+# Part of a processed model: a component (or the roots) and its descendants, down to depth levels
+@app.route('/get_processed_data/<filename>/subtree')
+def get_processed_subtree(filename):
+    json_path = os.path.join(app.config['PROCESSED_DATA_FOLDER'], secure_filename(filename))
+    if not os.path.exists(json_path):
+        return jsonify({'error': 'Processed data file not found.'}), 404
+    data, children, roots = load_processed_model(json_path, os.stat(json_path).st_mtime_ns)
+
+    root = request.args.get('root')
+    depth = request.args.get('depth', type=int)
+    if root is None:
+        frontier = list(roots)
+    elif root in data:
+        frontier = [root]
+    else:
+        return jsonify({'error': f'Component "{root}" not found.'}), 404
+
+    # Breadth first, so a depth limit keeps the levels nearest the root
+    components = {}
+    expandable = []
+    visited = set(frontier)
+    level = 0
+    while frontier:
+        next_frontier = []
+        for name in frontier:
+            components[name] = data[name]
+            below = [c for c in children.get(name, ()) if c not in visited]
+            if depth is not None and level >= depth:
+                if below:
+                    expandable.append(name)
+                continue
+            visited.update(below)
+            next_frontier.extend(below)
+        frontier = next_frontier
+        level += 1
+
+    return jsonify({'components': components, 'expandable': expandable, 'total': len(data)})
+
 # New endpoint to serve processed JSON data
 @app.route('/get_processed_data/<filename>')
 def get_processed_data(filename):
@@ -0,0 +1,198 @@
+"""
+Load benchmark of the web app against the fake model backend.
+
+    python benchmarks/bench_app.py [--uploads 20] [--chats 200] [--concurrency 8]
+                                   [--pages 20] [--latency 0.2] [--response-chars 2000]
+
+The app runs in a threaded server in this process, in a temporary working
+directory, with LLM_BACKEND=fake, so no model quota is used. Synthetic PDFs
+with distinct content (so uploads are not deduplicated) are uploaded
+concurrently. Their status is then polled until every task finishes, and
+/chat is asked questions about the processed files. For each endpoint the
+benchmark reports the number of requests, errors, requests/s and
+p50/p95/p99 latency. It also reports the time from upload to completed
+task.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+WORDS = ("pump valve motor tank cooler chiller compressor sensor pipe flange seawater gas pressure "
+         "temperature outlet inlet assembly system unit controller transformer heat exchanger").split()
+
+
+def synthetic_pdf(pages, seed):
+    """A minimal PDF with `pages` pages of pseudo-technical text, distinct per seed."""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for p in range(pages):
+        lines = [f"Document {seed} page {p + 1}"]
+        for _ in range(40):
+            lines.append(" ".join(rng.choice(WORDS) for _ in range(12)) + f" {rng.choice('ABCK')}{rng.randrange(999)}")
+        text = "BT /F1 10 Tf 12 TL 50 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        content = text.encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def request(self, endpoint, req):
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=300) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((start, elapsed))
+            if status >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return status, body
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def upload_request(base_url, name, pdf):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+            f"Content-Type: application/pdf\r\n\r\n").encode() + pdf + f"\r\n--{boundary}--\r\n".encode()
+    return urllib.request.Request(f"{base_url}/upload", data=body, method='POST',
+                                  headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+
+def run(args):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import app as app_module
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    recorder = Recorder()
+
+    pdfs = [(f"bench_{i}.pdf", synthetic_pdf(args.pages, f"{args.seed}-{i}")) for i in range(args.uploads)]
+
+    def upload_and_wait(item):
+        name, pdf = item
+        started = time.perf_counter()
+        status, body = recorder.request('/upload', upload_request(base_url, name, pdf))
+        if status != 202:
+            return None
+        task_id = json.loads(body)['task_id']
+        while True:
+            status, body = recorder.request('/status', f"{base_url}/status/{task_id}")
+            state = json.loads(body)
+            if state['status'] in ('completed', 'error', 'cancelled', 'not_found'):
+                return time.perf_counter() - started if state['status'] == 'completed' else None
+            time.sleep(args.poll_interval)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        task_times = list(pool.map(upload_and_wait, pdfs))
+    upload_seconds = time.perf_counter() - t0
+
+    questions = [f"What does the {rng_word} do?" for rng_word in WORDS]
+
+    def ask(i):
+        name = pdfs[i % len(pdfs)][0].replace('.pdf', '.json')
+        data = json.dumps({'question': questions[i % len(questions)] + f" ({i})", 'filename': name}).encode()
+        recorder.request('/chat', urllib.request.Request(f"{base_url}/chat", data=data, method='POST',
+                                                         headers={'Content-Type': 'application/json'}))
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(ask, range(args.chats)))
+    chat_seconds = time.perf_counter() - t0
+    server.shutdown()
+
+    print(f"{'endpoint':>10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    phase_seconds = {'/upload': upload_seconds, '/status': upload_seconds, '/chat': chat_seconds}
+    for endpoint in ('/upload', '/status', '/chat'):
+        latencies = [elapsed for _, elapsed in recorder.samples.get(endpoint, [])]
+        if not latencies:
+            continue
+        print(f"{endpoint:>10} {len(latencies):>9} {recorder.errors.get(endpoint, 0):>7} "
+              f"{len(latencies) / phase_seconds[endpoint]:>8.1f} {1000 * percentile(latencies, 50):>8.1f} "
+              f"{1000 * percentile(latencies, 95):>8.1f} {1000 * percentile(latencies, 99):>8.1f}")
+
+    done = [t for t in task_times if t is not None]
+    print()
+    print(f"tasks completed: {len(done)}/{len(task_times)} in {upload_seconds:.1f}s "
+          f"({len(done) / upload_seconds:.2f} tasks/s)")
+    if done:
+        print(f"upload to completed: p50 {percentile(done, 50):.2f}s, p95 {percentile(done, 95):.2f}s, "
+              f"p99 {percentile(done, 99):.2f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark /upload, /status and /chat with the fake model backend.")
+    parser.add_argument('--uploads', type=int, default=20)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds per fake model call")
+    parser.add_argument('--response-chars', type=int, default=2000, help="size of fake model answers")
+    parser.add_argument('--poll-interval', type=float, default=0.2)
+    parser.add_argument('--seed', default=str(os.getpid()))
+    args = parser.parse_args(argv)
+
+    # The app reads its settings at import and keeps its folders in the working directory
+    os.environ.update({'LLM_BACKEND': 'fake', 'FAKE_LLM_LATENCY': str(args.latency),
+                       'FAKE_LLM_RESPONSE_CHARS': str(args.response_chars), 'LLM_CACHE_MAX_MB': '0'})
+    workdir = tempfile.mkdtemp(prefix='bench_app_')
+    cwd = os.getcwd()
+    sys.path.insert(0, os.path.abspath(ROOT))
+    os.chdir(workdir)
+    try:
+        run(args)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Scaling benchmark of convert_json_to_imf.build_imf on synthetic plant models.
+
+    python benchmarks/bench_convert_json_to_imf.py [n_components ...]
+
+Two shapes are generated per size: 'wide' (every component has up to
+`branching` children) and 'deep' (a single chain, far deeper than Python's
+recursion limit). A second table compares writing the IMF file in one
+json.dump with the streaming writer in its indented, compact and gzip modes:
+time, output size and peak memory traced by tracemalloc.
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from convert_json_to_imf import build_imf, convert_json_to_imf
+
+
+def synthetic_model(n_components, shape='wide', branching=5, connections=2, seed=0):
+    """A JSON system description in the format produced by process_pdf_task."""
+    rng = random.Random(seed)
+    names = [f"component {i}_T{i}" for i in range(n_components)]
+    model = {}
+    for i, name in enumerate(names):
+        if i == 0:
+            part_of = []
+        elif shape == 'deep':
+            part_of = [names[i - 1]]
+        else:
+            part_of = [names[(i - 1) // branching]]
+        model[name] = {
+            "tagID": f"T{i}",
+            "partOf": part_of,
+            "fulfills": [f"function {rng.randrange(1000)}" for _ in range(rng.randrange(3))],
+            "connectedTo": [names[rng.randrange(n_components)] for _ in range(rng.randrange(connections + 1))],
+            "hasTerminal": [],
+        }
+    return model
+
+
+def measure(fn):
+    # Timed and traced in separate runs, as tracing slows Python down a lot
+    t0 = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench_writers(n, folder):
+    source = os.path.join(folder, 'model.json')
+    with open(source, 'w') as f:
+        json.dump(synthetic_model(n), f)
+
+    def json_dump():
+        with open(source) as f:
+            imf = build_imf(json.load(f))
+        with open(os.path.join(folder, 'dump.imf'), 'w') as f:
+            json.dump(imf, f, indent=2)
+
+    modes = [('json.dump', 'dump.imf', json_dump),
+             ('stream', 'stream.imf', lambda: convert_json_to_imf(source, os.path.join(folder, 'stream.imf'))),
+             ('compact', 'compact.imf',
+              lambda: convert_json_to_imf(source, os.path.join(folder, 'compact.imf'), compact=True)),
+             ('gzip', 'compact.imf.gz',
+              lambda: convert_json_to_imf(source, os.path.join(folder, 'compact.imf.gz'), compact=True))]
+    for mode, filename, fn in modes:
+        elapsed, peak = measure(fn)
+        size = os.path.getsize(os.path.join(folder, filename))
+        print(f"{n:>10} {mode:>9} {elapsed:>8.2f} {size / 1e6:>8.1f} {peak / 1e6:>8.1f}")
+
+
+def main(sizes):
+    print(f"{'components':>10} {'shape':>5} {'nodes':>8} {'edges':>8} {'seconds':>8} {'nodes/s':>10}")
+    for n in sizes:
+        for shape in ('wide', 'deep'):
+            model = synthetic_model(n, shape)
+            t0 = time.perf_counter()
+            imf = build_imf(model)
+            elapsed = time.perf_counter() - t0
+            print(f"{n:>10} {shape:>5} {len(imf['nodes']):>8} {len(imf['edges']):>8} "
+                  f"{elapsed:>8.3f} {len(imf['nodes']) / elapsed:>10.0f}")
+
+    print()
+    print(f"{'components':>10} {'writer':>9} {'seconds':>8} {'file MB':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        for n in sizes:
+            bench_writers(n, folder)
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,109 @@
+"""
+Benchmark of utils.parse_json against the previous regex-based implementation
+on large synthetic model outputs. For each implementation the best time of
+three runs and the number of components recovered are printed.
+
+    python benchmarks/bench_parse_json.py [n_components ...]
+"""
+import os
+import re
+import io
+import sys
+import json
+import time
+import random
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import parse_json
+
+
+def legacy_parse_json(results_string):
+    # parse_json as it was before the single-pass repair scanner
+    cleaned_string = results_string.replace('\n', '')
+    json_string = re.sub(r'"\s*([\]}])\s*"', r'"\1,""', cleaned_string)
+    json_string = re.sub(r'([\]}])\s*([^\],})\s*\n])', r'\1,\2', json_string)
+    json_string = re.sub(r',\s*}', '}', json_string)
+    match = re.search(r'\{.*\}', json_string, re.DOTALL)
+    if match:
+        content = match.group(0)
+    else:
+        print("No content found between curly braces.")
+
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        if "Expecting ',' delimiter" in str(e):
+            try:
+                return json.loads(content.rstrip() + '}')
+            except json.JSONDecodeError:
+                return None
+        return {}
+
+
+def synthetic_output(n_components, style, seed=0):
+    """
+    A relations-style model response with n_components entries.
+
+    style is 'valid', 'broken' (missing and trailing commas, truncated end) or
+    'prompt' (unquoted list items and # comments, as in the prompt's example).
+    """
+    rng = random.Random(seed)
+    model = {}
+    names = [f"component {i}" for i in range(n_components)]
+    for i, name in enumerate(names):
+        model[name] = {
+            "tagID": f"T{i:06d}",
+            "partOf": [names[rng.randrange(i)]] if i else [],
+            "fulfills": [f"function {rng.randrange(100)}" for _ in range(rng.randrange(3))],
+            "connectedTo": [names[rng.randrange(n_components)] for _ in range(rng.randrange(4))],
+            "hasTerminal": [f"terminal {rng.randrange(50)}" for _ in range(rng.randrange(3))],
+        }
+    text = json.dumps(model, indent=4)
+    lines = text.split('\n')
+    for j, line in enumerate(lines):
+        roll = rng.random()
+        stripped = line.strip()
+        if style == 'broken':
+            if stripped == '},' and roll < 0.2:
+                lines[j] = line.rstrip()[:-1]            # missing comma between entries
+            elif stripped.endswith(']') and roll < 0.4:
+                lines[j] = line + ','                    # trailing comma before }
+        elif style == 'prompt':
+            if stripped.startswith('"component') and not stripped.endswith('{'):
+                lines[j] = line.replace('"', '')         # unquoted list item
+            elif stripped.startswith('"partOf"') and roll < 0.1:
+                lines[j] = line + '  # direct parent'
+    text = '\n'.join(lines)
+    if style == 'broken':
+        text = text[:int(len(text) * 0.98)]             # truncated response
+    return f"```json\n{text}\n```"
+
+
+def run(fn, text, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            try:
+                result = fn(text)
+            except Exception:
+                result = None
+            best = min(best, time.perf_counter() - t0)
+    return best, len(result) if isinstance(result, dict) else 0
+
+
+def main(sizes):
+    print(f"{'components':>10} {'style':>6} {'MB':>6} {'legacy s':>9} {'legacy n':>9} {'new s':>7} {'new n':>7}")
+    for n in sizes:
+        for style in ('valid', 'broken', 'prompt'):
+            text = synthetic_output(n, style)
+            legacy_t, legacy_n = run(legacy_parse_json, text)
+            new_t, new_n = run(parse_json, text)
+            print(f"{n:>10} {style:>6} {len(text) / 1e6:>6.2f} "
+                  f"{legacy_t:>9.3f} {legacy_n:>9} {new_t:>7.3f} {new_n:>7}")
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,65 @@
+"""
+Benchmark of the transfer (connectedTo) edges of convert_json_to_imf on
+densely connected synthetic models.
+
+    python benchmarks/bench_transfer_edges.py [n_components ...]
+
+Every component gets up to 2 * CONNECTIONS references. They are written the
+way models write them: the exact key, the tagID alone, the name without its
+tagID, or "name (tagID)". Many pairs are listed from both ends. The table
+shows how many references an exact key lookup resolves compared with
+NameResolver. It also shows the time to plan the IMF and to emit every edge.
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from convert_json_to_imf import ImfPlan, NameResolver
+from bench_convert_json_to_imf import synthetic_model
+
+CONNECTIONS = 20
+
+
+def connected_model(n_components, seed=0):
+    rng = random.Random(seed)
+    model = synthetic_model(n_components, connections=CONNECTIONS, seed=seed)
+    names = list(model)
+    styles = [lambda i: names[i], lambda i: f"T{i}", lambda i: f"component {i}",
+              lambda i: f"Component {i} (T{i})"]
+    for i, name in enumerate(names):
+        refs = []
+        for _ in model[name]["connectedTo"]:
+            j = rng.randrange(n_components)
+            refs.append(rng.choice(styles)(j))
+            if rng.random() < 0.5:
+                # The same pair listed again from the other end
+                model[names[j]].setdefault("reverse", []).append(rng.choice(styles)(i))
+        model[name]["connectedTo"] = refs
+    for details in model.values():
+        details["connectedTo"] += details.pop("reverse", [])
+    return model
+
+
+def main(sizes):
+    print(f"{'components':>10} {'refs':>9} {'exact %':>8} {'resolved %':>10} {'transfer':>9} "
+          f"{'plan s':>7} {'edges s':>8} {'edges/s':>9}")
+    for n in sizes:
+        model = connected_model(n)
+        refs = [ref for details in model.values() for ref in details["connectedTo"]]
+        exact = sum(1 for ref in refs if ref in model)
+        resolver = NameResolver(list(model), [details["tagID"] for details in model.values()])
+        resolved = sum(1 for ref in refs if resolver.resolve(ref) is not None)
+
+        t0 = time.perf_counter()
+        plan = ImfPlan(model)
+        t1 = time.perf_counter()
+        edges = sum(1 for _ in plan.iter_edges())
+        t2 = time.perf_counter()
+        print(f"{n:>10} {len(refs):>9} {100 * exact / len(refs):>8.1f} {100 * resolved / len(refs):>10.1f} "
+              f"{len(plan.transfers):>9} {t1 - t0:>7.2f} {t2 - t1:>8.2f} {edges / (t2 - t1):>9.0f}")
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [1000, 10000, 50000])
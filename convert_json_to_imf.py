@@ -1,312 +1,852 @@
 import json
 import os
+import sys
+import glob
+import bisect
+import gzip
 import time
 import random
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def convert_json_to_imf(input_path, output_path):
-    """
-    Converts a JSON system description to an IMF file format.
+# Layout of product blocks (hierarchy) and function blocks (row above it)
+X_GAP = 250
+Y_GAP = 150
+FUNC_Y = -400
+FUNC_X_GAP = 150
+NODE_WIDTH = 110
+NODE_HEIGHT = 66
+
+
+def build_hierarchy(source_data):
     """
-    
-    if not os.path.exists(input_path):
-        print(f"Error: Input file not found at {input_path}")
-        return
+    Index the components of a JSON system description.
 
-    with open(input_path, 'r') as f:
-        source_data = json.load(f)
+    Components are numbered in source order. Returns (names, details,
+    parent_idx, child_start, child_list, roots): parent_idx[i] is the index of
+    the first partOf entry of component i, or -1 if it has none or it is not a
+    component; the children of i are child_list[child_start[i]:child_start[i + 1]],
+    in source order; roots are the components without partOf.
+    """
+    names = list(source_data)
+    details = [source_data[name] for name in names]
+    name_to_idx = {name: i for i, name in enumerate(names)}
+    n = len(names)
 
-    nodes = []
-    edges = []
-    
-    # Map System Name to TagID for resolving references
-    system_name_to_id = {name: details.get("tagID") for name, details in source_data.items()}
-    
-    # Map TagID to Node index for updating children later
-    id_to_node_index = {}
-    id_to_label = {}
-    id_to_node_map = {}
-
-    # --- Hierarchical Layout Logic ---
-    nodes_tree = {}
+    parent_idx = [-1] * n
     roots = []
-
-    # 1. Initialize tree structure
-    for system_name in source_data:
-        nodes_tree[system_name] = {
-            "children": [],
-            "subtree_width": 0,
-            "position": {"x": 0, "y": 0}
-        }
-
-    # 2. Build parent-child relationships
-    for system_name, details in source_data.items():
-        part_of_list = details.get("partOf", [])
+    child_count = [0] * n
+    for i, d in enumerate(details):
+        part_of_list = d.get("partOf", [])
         if part_of_list:
-            parent_name = part_of_list[0]  # Assuming one primary parent
-            if parent_name in nodes_tree:
-                nodes_tree[parent_name]["children"].append(system_name)
+            p = name_to_idx.get(part_of_list[0], -1)  # Assuming one primary parent
+            parent_idx[i] = p
+            if p >= 0:
+                child_count[p] += 1
         else:
-            roots.append(system_name)
-
-    # 3. Define layout functions
-    X_GAP = 250
-    Y_GAP = 150
-
-    def calculate_subtree_width(node_name):
-        node = nodes_tree[node_name]
-        if not node["children"]:
-            node["subtree_width"] = X_GAP
-            return X_GAP
-        
-        total_width = sum(calculate_subtree_width(child_name) for child_name in node["children"])
-        width = max(X_GAP, total_width)
-        node["subtree_width"] = width
-        return width
-
-    def layout_tree(node_name, x_start, y_start):
-        node = nodes_tree[node_name]
-        children_total_width = sum(nodes_tree[child_name]["subtree_width"] for child_name in node["children"]) if node["children"] else 0
-        parent_x = x_start + (max(0, children_total_width - X_GAP) / 2)
-        node["position"] = {"x": parent_x, "y": y_start}
-        current_x_child = x_start
-        for child_name in node["children"]:
-            layout_tree(child_name, current_x_child, y_start + Y_GAP)
-            current_x_child += nodes_tree[child_name]["subtree_width"]
-
-    # 4. Apply layout algorithm
-    current_x_root = 0
-    for root_name in roots:
-        calculate_subtree_width(root_name)
-        layout_tree(root_name, current_x_root, 0)
-        current_x_root += nodes_tree[root_name]["subtree_width"] + X_GAP
-    # --- End of Layout Logic ---
-
-    current_label_index = 1
-    function_data_list = []
-
-    # 1. Create Nodes
-    for system_name, details in source_data.items():
-        tag_id = details.get("tagID")
-        
-        # Determine Parent
-        part_of_list = details.get("partOf", [])
-        parent_id = "void"
-        direct_part_of = ""
-        
-        if part_of_list:
-            # Take the first parent as the primary parent
-            parent_name = part_of_list[0]
-            if parent_name in system_name_to_id:
-                parent_id = system_name_to_id[parent_name]
-                direct_part_of = parent_id
-
-        # Get pre-calculated position
-        position = nodes_tree[system_name]["position"]
-
-        # Generate random createdAt timestamp (milliseconds)
-        created_at = int(time.time() * 1000) - random.randint(0, 10000000)
-
-        # --- Create Function Nodes ---
-        fulfills_list = details.get("fulfills", [])
-        func_ids = []
-
-        for i, func_desc in enumerate(fulfills_list):
-            func_tag_id = f"{tag_id}_func_{i}"
-            func_label = f"Block{current_label_index}"
-            current_label_index += 1
-            id_to_label[func_tag_id] = func_label
-
-            function_data_list.append({
-                "id": func_tag_id,
-                "label": func_label,
-                "desc": func_desc,
-                "product_id": tag_id,
-                "product_x": position["x"],
-                "product_y": position["y"],
-                "index": i
-            })
-            func_ids.append(func_tag_id)
-
-        # --- Create Product Node ---
-        label = f"Block{current_label_index}"
-        current_label_index += 1
-        id_to_label[tag_id] = label
-
-        node = {
-            "data": {
-                "parent": parent_id,
-                "children": [], # Populated in pass 2
-                "terminals": [],
-                "fulfilledBy": [{"id": fid} for fid in func_ids], # Product fulfilledBy Function
-                "fulfills": [],
-                "directParts": [], # Populated in pass 2
-                "connectedTo": [],
-                "connectedBy": [],
-                "directPartOf": direct_part_of,
-                "customName": system_name,
-                "customAttributes": [],
-                "aspect": "product",
-                "label": system_name,
-                "label": label,
-                "createdAt": created_at,
-                "updatedAt": created_at,
-                "createdBy": "system",
-                "width": 110,
-                "height": 66
-            },
-            "width": 110,
-            "height": 66,
-            "id": tag_id,
-            "position": position,
-            "type": "block",
-            "selected": False
-        }
-        
-        nodes.append(node)
-        id_to_node_map[tag_id] = node
-
-    # 2. Layout and Create Function Nodes
-    # Sort by product X, then product Y, then index
-    function_data_list.sort(key=lambda k: (k['product_x'], k['product_y'], k['index']))
-
-    current_func_x = 0
-    FUNC_Y = -400
-    FUNC_X_GAP = 150 
-
-    for func_data in function_data_list:
-        # Determine X: Try to align with product, but ensure no overlap with previous
-        target_x = func_data['product_x']
-        if current_func_x < target_x:
-            current_func_x = target_x
-        
-        position = {"x": current_func_x, "y": FUNC_Y}
-        current_func_x += FUNC_X_GAP
-
-        func_created_at = int(time.time() * 1000) - random.randint(0, 10000000)
-        func_node = {
-            "data": {
-                "parent": "void",
-                "children": [],
-                "terminals": [],
-                "fulfilledBy": [], 
-                "fulfills": [{"id": func_data['product_id']}], # Function fulfills Product
-                "directParts": [],
-                "connectedTo": [],
-                "connectedBy": [],
-                "directPartOf": "",
-                "customName": func_data['desc'],
-                "customAttributes": [],
-                "aspect": "function",
-                "label": func_data['label'],
-                "createdAt": func_created_at,
-                "updatedAt": func_created_at,
-                "createdBy": "system",
-                "width": 110,
-                "height": 66
-            },
-            "width": 110,
-            "height": 66,
-            "id": func_data['id'],
-            "position": position,
-            "type": "block",
-            "selected": False
-        }
-        nodes.append(func_node)
-        id_to_node_map[func_data['id']] = func_node
-
-    # 3. Populate Children (Data)
-    for node in nodes:
-        if node["data"]["aspect"] == "product":
-            parent_id = node["data"]["parent"]
-            if parent_id != "void" and parent_id in id_to_node_map:
-                parent_node = id_to_node_map[parent_id]
-                child_ref = {"id": node["id"]}
-                parent_node["data"]["children"].append(child_ref)
-                parent_node["data"]["directParts"].append(child_ref)
-
-    # 4. Create Edges
-    edge_counter = 0
-    
-    def create_edge(source, target, edge_type):
-        nonlocal edge_counter
-        source_label = id_to_label.get(source, "Unknown")
-        target_label = id_to_label.get(target, "Unknown")
-        
-        # Determine spatial relation
-        source_dir, target_dir = "right", "left"
-        if source in id_to_node_map and target in id_to_node_map:
-            s_pos = id_to_node_map[source]["position"]
-            t_pos = id_to_node_map[target]["position"]
-            dx = t_pos["x"] - s_pos["x"]
-            dy = t_pos["y"] - s_pos["y"]
-            if abs(dx) >= abs(dy):
-                if dx >= 0: source_dir, target_dir = "right", "left"
-                else: source_dir, target_dir = "left", "right"
-            else:
-                if dy >= 0: source_dir, target_dir = "bottom", "top"
-                else: source_dir, target_dir = "top", "bottom"
+            roots.append(i)
+
+    # Children as one flat array (CSR layout), filled in source order
+    child_start = [0] * (n + 1)
+    for i in range(n):
+        child_start[i + 1] = child_start[i] + child_count[i]
+    child_list = [0] * child_start[n]
+    fill = child_start[:n]
+    for i, p in enumerate(parent_idx):
+        if p >= 0:
+            child_list[fill[p]] = i
+            fill[p] += 1
+
+    return names, details, parent_idx, child_start, child_list, roots
+
+
+def _preorder(child_start, child_list, roots):
+    order = []
+    for root in roots:
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            order.append(v)
+            stack.extend(reversed(child_list[child_start[v]:child_start[v + 1]]))
+    return order
+
+
+def subtree_widths(child_start, child_list, order):
+    """
+    Width of every subtree in `order` (a pre-order) and of its children
+    together. A subtree is at least X_GAP wide.
+    """
+    n = len(child_start) - 1
+    width = [0] * n
+    children_width = [0] * n
+    # Reversed pre-order visits children before parents
+    for v in reversed(order):
+        total = 0
+        for c in child_list[child_start[v]:child_start[v + 1]]:
+            total += width[c]
+        children_width[v] = total
+        width[v] = max(X_GAP, total)
+    return width, children_width
+
+
+def layout_hierarchy(child_start, child_list, roots, origins=None):
+    """
+    Place every component reachable from `roots` in a top-down tree layout.
+
+    Each subtree gets a width of at least X_GAP, children are laid out left to
+    right and a parent is centred above them. origins, if given, is the (x, y)
+    of the left edge of each root's subtree; by default the trees are placed
+    side by side from (0, 0), X_GAP apart. Returns (xs, ys); components not
+    reachable from a root keep x = y = None. Iterative, so deep hierarchies do
+    not hit the recursion limit.
+    """
+    n = len(child_start) - 1
+    xs = [None] * n
+    ys = [None] * n
+    order = _preorder(child_start, child_list, roots)
+    width, children_width = subtree_widths(child_start, child_list, order)
+
+    x_start = [0] * n
+    if origins is None:
+        current_x_root = 0
+        origins = []
+        for root in roots:
+            origins.append((current_x_root, 0))
+            current_x_root += width[root] + X_GAP
+    for root, (x, y) in zip(roots, origins):
+        x_start[root] = x
+        ys[root] = y
+
+    for v in order:
+        xs[v] = x_start[v] + (max(0, children_width[v] - X_GAP) / 2)
+        current_x_child = x_start[v]
+        for c in child_list[child_start[v]:child_start[v + 1]]:
+            x_start[c] = current_x_child
+            ys[c] = ys[v] + Y_GAP
+            current_x_child += width[c]
+
+    return xs, ys
+
+
+def _block(node_id, data, position):
+    data["width"] = NODE_WIDTH
+    data["height"] = NODE_HEIGHT
+    return {
+        "data": data,
+        "width": NODE_WIDTH,
+        "height": NODE_HEIGHT,
+        "id": node_id,
+        "position": position,
+        "type": "block",
+        "selected": False
+    }
+
+
+def _block_data(parent, fulfilled_by, fulfills, direct_part_of, custom_name, aspect, label, created_at):
+    return {
+        "parent": parent,
+        "children": [],
+        "terminals": [],
+        "fulfilledBy": fulfilled_by,
+        "fulfills": fulfills,
+        "directParts": [],
+        "connectedTo": [],
+        "connectedBy": [],
+        "directPartOf": direct_part_of,
+        "customName": custom_name,
+        "customAttributes": [],
+        "aspect": aspect,
+        "label": label,
+        "createdAt": created_at,
+        "updatedAt": created_at,
+        "createdBy": "system",
+    }
+
+
+def _number_suffix(text, prefix):
+    if isinstance(text, str) and text.startswith(prefix) and text[len(prefix):].isdigit():
+        return int(text[len(prefix):])
+    return -1
+
+
+def _nth_previous(previous, element_id, seen):
+    # The next element of a previous file with this id, or None
+    k = seen.get(element_id, 0)
+    seen[element_id] = k + 1
+    matches = previous.get(element_id, ())
+    return matches[k] if k < len(matches) else None
 
-        edge_created_at = int(time.time() * 1000) - random.randint(0, 10000000)
+
+def _normalize_name(name):
+    return " ".join(name.replace("_", " ").lower().split())
+
+
+def _split_tag_suffix(name):
+    # "pump_B223", "pump B223" and "pump (B223)" -> ("pump", "B223")
+    name = name.strip()
+    if name.endswith(")") and "(" in name:
+        i = name.rindex("(")
+        return name[:i].strip(), name[i + 1:-1].strip()
+    for sep in ("_", " "):
+        if sep in name:
+            base, suffix = name.rsplit(sep, 1)
+            return base.strip(), suffix
+    return name, None
+
+
+class NameResolver:
+    """
+    Resolve the component names used in connectedTo to tagIDs.
+
+    Models refer to components inconsistently: by their exact key, by the
+    tagID alone, or with the tagID suffix missing or attached differently
+    ("pump", "pump_B223", "pump B223", "pump (B223)"). Every lookup is a few
+    dict accesses; names that could mean more than one component are not
+    resolved.
+    """
+
+    def __init__(self, names, tags):
+        self.by_name = {}
+        self.tags = set()
+        self.by_base = {}
+        for name, tag_id in zip(names, tags):
+            if tag_id is None:
+                continue
+            self.by_name[name] = tag_id
+            self.tags.add(tag_id)
+            base, suffix = _split_tag_suffix(name)
+            keys = {_normalize_name(name)}
+            if suffix == tag_id:
+                keys.add(_normalize_name(base))
+            for key in keys:
+                if self.by_base.setdefault(key, tag_id) != tag_id:
+                    self.by_base[key] = None  # ambiguous
+
+    def resolve(self, ref):
+        if not isinstance(ref, str):
+            return None
+        tag_id = self.by_name.get(ref)
+        if tag_id is not None:
+            return tag_id
+        if ref in self.tags:
+            return ref
+        base, suffix = _split_tag_suffix(ref)
+        if suffix in self.tags:
+            return suffix
+        return self.by_base.get(_normalize_name(ref))
+
+
+def _handle_directions(s_pos, t_pos):
+    dx = t_pos["x"] - s_pos["x"]
+    dy = t_pos["y"] - s_pos["y"]
+    if abs(dx) >= abs(dy):
+        return ("right", "left") if dx >= 0 else ("left", "right")
+    return ("bottom", "top") if dy >= 0 else ("top", "bottom")
+
+
+class ImfPlan:
+    """
+    Everything needed to emit the IMF nodes and edges of a system one at a
+    time: layout, labels and the id lookups used by edges. It holds a few
+    small values per component rather than the node and edge dicts
+    themselves, so nodes and edges can be streamed to a file.
+
+    Given the content of a previous IMF file for the same system, the plan is
+    incremental: blocks and edges whose id already exists keep their label,
+    position and timestamps (updatedAt changes only if the block changed), and
+    only new components, components whose parent changed and their subtrees
+    are laid out again, next to the existing blocks.
+    """
+
+    def __init__(self, source_data, previous=None):
+        names, details, parent_idx, child_start, child_list, roots = build_hierarchy(source_data)
+        n = len(names)
+        self.names = names
+        self.tags = [d.get("tagID") for d in details]
+        self.parent_ids = [self.tags[p] if p >= 0 else "void" for p in parent_idx]
+        self.now_ms = int(time.time() * 1000)
+        self.incremental = previous is not None
+
+        self.previous_nodes = {}
+        self.previous_edges = {}
+        current_label_index = 1
+        self.first_edge_number = 0
+        if self.incremental:
+            # Lists, because models sometimes give two components the same tagID;
+            # the n-th block with an id is matched with the n-th one before
+            for node in previous.get("nodes", []):
+                self.previous_nodes.setdefault(node["id"], []).append(node)
+            for edge in previous.get("edges", []):
+                self.previous_edges.setdefault(edge["id"], []).append(edge)
+            current_label_index = 1 + max((_number_suffix(node["data"].get("label"), "Block")
+                                           for node in previous.get("nodes", [])), default=0)
+            self.first_edge_number = 1 + max((_number_suffix(edge["data"].get("id"), "")
+                                              for edge in previous.get("edges", [])), default=-1)
+        seen = {}
+        self.previous_products = [_nth_previous(self.previous_nodes, tag_id, seen) for tag_id in self.tags]
+        if self.incremental:
+            self.positions = self._incremental_positions(parent_idx, child_start, child_list, roots)
+        else:
+            xs, ys = layout_hierarchy(child_start, child_list, roots)
+            self.positions = [{"x": xs[i], "y": ys[i]} if xs[i] is not None else {"x": 0, "y": 0}
+                              for i in range(n)]
+
+        self.labels = [None] * n
+        self.func_ids = [None] * n
+        self.id_to_label = {}
+        functions = []
+        for i in range(n):
+            tag_id = self.tags[i]
+            func_ids = []
+            for k, func_desc in enumerate(details[i].get("fulfills", [])):
+                func_tag_id = f"{tag_id}_func_{k}"
+                prev = _nth_previous(self.previous_nodes, func_tag_id, seen)
+                func_label = prev["data"].get("label") if prev is not None else None
+                if func_label is None:
+                    func_label = f"Block{current_label_index}"
+                    current_label_index += 1
+                self.id_to_label[func_tag_id] = func_label
+                functions.append((self.positions[i]["x"], self.positions[i]["y"], k,
+                                  func_tag_id, func_label, func_desc, tag_id, prev))
+                func_ids.append(func_tag_id)
+            self.func_ids[i] = func_ids
+            prev = self.previous_products[i]
+            label = prev["data"].get("label") if prev is not None else None
+            if label is None:
+                label = f"Block{current_label_index}"
+                current_label_index += 1
+            self.labels[i] = label
+            self.id_to_label[tag_id] = label
+
+        # Function blocks in one row, ordered by product position, without
+        # overlap. Unchanged functions of a previous file stay where they were
+        # and new ones are added to the right of them.
+        functions.sort(key=lambda f: (f[0], f[1], f[2]))
+        kept_func_x = [f[7]["position"]["x"] for f in functions
+                       if f[7] is not None and f[7]["data"].get("customName") == f[5]]
+        current_func_x = max(kept_func_x) + FUNC_X_GAP if kept_func_x else 0
+        self.functions = []
+        self.previous_functions = []
+        for product_x, _, _, func_tag_id, func_label, func_desc, product_id, prev in functions:
+            if prev is not None and prev["data"].get("customName") == func_desc:
+                position = prev["position"]
+            else:
+                if current_func_x < product_x:
+                    current_func_x = product_x
+                position = {"x": current_func_x, "y": FUNC_Y}
+                current_func_x += FUNC_X_GAP
+            self.functions.append((func_tag_id, func_label, func_desc, product_id, position))
+            self.previous_functions.append(prev)
+
+        # On duplicate ids the last block wins, as in the editor; it also
+        # receives the children that refer to that id.
+        self.id_to_position = {}
+        owner = {}
+        for i in range(n):
+            self.id_to_position[self.tags[i]] = self.positions[i]
+            owner[self.tags[i]] = i
+        for j, (func_tag_id, _, _, _, position) in enumerate(self.functions):
+            self.id_to_position[func_tag_id] = position
+            owner[func_tag_id] = n + j
+
+        # Child ids by block number (products first, then functions)
+        self.children = {}
+        for i in range(n):
+            parent_id = self.parent_ids[i]
+            if parent_id != "void" and parent_id in owner:
+                self.children.setdefault(owner[parent_id], []).append(self.tags[i])
+
+        # Transfer edges, one per physically connected pair whatever the
+        # direction(s) the model gave, with the connected ids by block number
+        resolver = NameResolver(names, self.tags)
+        self.transfers = []
+        self.connected_to = {}
+        self.connected_by = {}
+        pairs = set()
+        for i in range(n):
+            source_id = self.tags[i]
+            if source_id is None:
+                continue
+            for target_name in details[i].get("connectedTo", []):
+                target_id = resolver.resolve(target_name)
+                if target_id is None or target_id == source_id:
+                    continue
+                pair = frozenset((source_id, target_id))
+                if pair in pairs:
+                    continue
+                pairs.add(pair)
+                self.transfers.append((source_id, target_id))
+                self.connected_to.setdefault(i, []).append(target_id)
+                self.connected_by.setdefault(owner[target_id], []).append(source_id)
+
+    def _incremental_positions(self, parent_idx, child_start, child_list, roots):
+        n = len(self.tags)
+        positions = [None] * n
+        kept = [False] * n
+        for i, prev in enumerate(self.previous_products):
+            if prev is not None and prev["data"].get("aspect") == "product" \
+                    and prev["data"].get("parent") == self.parent_ids[i]:
+                kept[i] = True
+                positions[i] = prev["position"]
+
+        # A subtree is laid out again as a whole from its topmost changed component
+        order = _preorder(child_start, child_list, roots)
+        placement_roots = []
+        for v in order:
+            p = parent_idx[v]
+            if p >= 0 and not kept[p]:
+                kept[v] = False
+                positions[v] = None
+            elif not kept[v]:
+                placement_roots.append(v)
+
+        # Rightmost kept block in each subtree, so new subtrees go next to it
+        kept_max_x = [None] * n
+        for v in reversed(order):
+            m = positions[v]["x"] if kept[v] else None
+            for c in child_list[child_start[v]:child_start[v + 1]]:
+                if kept_max_x[c] is not None and (m is None or kept_max_x[c] > m):
+                    m = kept_max_x[c]
+            kept_max_x[v] = m
+
+        # Occupied x intervals per row, sorted and disjoint, so a new subtree
+        # can slide right to the first gap where none of its rows overlap
+        rows = {}
+        for i in range(n):
+            if kept[i]:
+                rows.setdefault(positions[i]["y"], []).append(positions[i]["x"])
+        for y, row in rows.items():
+            row.sort()
+            rows[y] = (row, list(row))
+
+        placed_order = _preorder(child_start, child_list, placement_roots)
+        width, _ = subtree_widths(child_start, child_list, placed_order)
+        height = [1] * n
+        for v in reversed(placed_order):
+            for c in child_list[child_start[v]:child_start[v + 1]]:
+                height[v] = max(height[v], height[c] + 1)
+
+        origins = []
+        for r in placement_roots:
+            p = parent_idx[r]
+            if p < 0:
+                x, y = 0, 0
+            else:
+                sibling_x = [kept_max_x[c] for c in child_list[child_start[p]:child_start[p + 1]]
+                             if kept_max_x[c] is not None]
+                x = max(sibling_x) + X_GAP if sibling_x else positions[p]["x"]
+                y = positions[p]["y"] + Y_GAP
+            levels = [y + k * Y_GAP for k in range(height[r])]
+            span = width[r] - X_GAP
+            moved = True
+            while moved:
+                moved = False
+                for level in levels:
+                    if level not in rows:
+                        continue
+                    starts, ends = rows[level]
+                    k = bisect.bisect_left(starts, x + span + X_GAP) - 1
+                    if k >= 0 and ends[k] > x - X_GAP:
+                        x = ends[k] + X_GAP
+                        moved = True
+            for level in levels:
+                starts, ends = rows.setdefault(level, ([], []))
+                k = bisect.bisect_left(starts, x)
+                starts.insert(k, x)
+                ends.insert(k, x + span)
+            origins.append((x, y))
+
+        xs, ys = layout_hierarchy(child_start, child_list, placement_roots, origins)
+        for i in range(n):
+            if positions[i] is None:
+                positions[i] = {"x": xs[i], "y": ys[i]} if xs[i] is not None else {"x": 0, "y": 0}
+        return positions
+
+    def _created_at(self):
+        if self.incremental:
+            return self.now_ms
+        return self.now_ms - random.randint(0, 10000000)
+
+    def _restamp(self, node, prev):
+        # Keep the timestamps of a block that existed before; bump updatedAt if it changed
+        if prev is None:
+            return node
+        data = node["data"]
+        prev_data = prev["data"]
+        data["createdAt"] = prev_data.get("createdAt", data["createdAt"])
+        data["updatedAt"] = prev_data.get("updatedAt", data["createdAt"])
+        if node["position"] != prev.get("position") or any(data[k] != prev_data.get(k) for k in data):
+            data["updatedAt"] = self.now_ms
+        return node
+
+    def iter_nodes(self):
+        """Yield the product nodes in source order, then the function nodes."""
+        for i, tag_id in enumerate(self.tags):
+            parent_id = self.parent_ids[i]
+            data = _block_data(parent_id, [{"id": fid} for fid in self.func_ids[i]], [],
+                               parent_id if parent_id != "void" else "", self.names[i],
+                               "product", self.labels[i], self._created_at())
+            self._add_children(data, i)
+            self._add_connections(data, i)
+            yield self._restamp(_block(tag_id, data, self.positions[i]), self.previous_products[i])
+
+        n = len(self.tags)
+        for j, (func_tag_id, func_label, func_desc, product_id, position) in enumerate(self.functions):
+            data = _block_data("void", [], [{"id": product_id}], "", func_desc,
+                               "function", func_label, self._created_at())
+            self._add_children(data, n + j)
+            yield self._restamp(_block(func_tag_id, data, position), self.previous_functions[j])
+
+    def _add_children(self, data, block):
+        child_refs = [{"id": child_id} for child_id in self.children.get(block, ())]
+        data["children"] = child_refs
+        data["directParts"] = list(child_refs)
+
+    def _add_connections(self, data, block):
+        data["connectedTo"] = [{"id": target_id} for target_id in self.connected_to.get(block, ())]
+        data["connectedBy"] = [{"id": source_id} for source_id in self.connected_by.get(block, ())]
+
+    def _edge(self, edge_number, source, target, edge_type, seen):
+        """Return (edge, is_new); an unchanged edge of the previous file is reused as is."""
+        source_dir, target_dir = "right", "left"
+        s_pos = self.id_to_position.get(source)
+        t_pos = self.id_to_position.get(target)
+        if s_pos is not None and t_pos is not None:
+            source_dir, target_dir = _handle_directions(s_pos, t_pos)
         edge_id = f"reactflow__edge-{source}-{target}-{edge_type}"
-        
+        source_handle = f"{self.id_to_label.get(source, 'Unknown')}_{source_dir}_source"
+        target_handle = f"{self.id_to_label.get(target, 'Unknown')}_{target_dir}_target"
+
+        prev = _nth_previous(self.previous_edges, edge_id, seen)
+        if prev is not None and prev.get("sourceHandle") == source_handle \
+                and prev.get("targetHandle") == target_handle:
+            return prev, False
+
+        created_at = self._created_at()
         return {
             "id": edge_id,
             "source": source,
-            "sourceHandle": f"{source_label}_{source_dir}_source",
+            "sourceHandle": source_handle,
             "target": target,
-            "targetHandle": f"{target_label}_{target_dir}_target",
+            "targetHandle": target_handle,
             "type": edge_type,
             "data": {
-                "id": str(edge_counter),
-                "createdAt": edge_created_at,
-                "updatedAt": edge_created_at,
+                "id": str(edge_number),
+                "createdAt": created_at,
+                "updatedAt": created_at,
                 "lockConnection": False,
-                "label": f"Edge {edge_counter}",
+                "label": f"Edge {edge_number}",
                 "createdBy": "system"
             },
             "selected": False
-        }
-
-    # Iterate nodes for Part and Fulfilled edges
-    for node in nodes:
-        source_id = node["id"]
-        
-        # Part Edges: Child -> Parent
-        if node["data"]["aspect"] == "product":
-            parent_id = node["data"]["parent"]
-            if parent_id != "void":
-                edges.append(create_edge(source_id, parent_id, "part"))
-                edge_counter += 1
-
-        # Fulfilled Edges: Product -> Function
-        # (Based on data.fulfilledBy which we populated earlier)
-        if node["data"]["aspect"] == "product":
-            for func_ref in node["data"]["fulfilledBy"]:
-                func_id = func_ref["id"]
-                edges.append(create_edge(source_id, func_id, "fulfilled"))
-                edge_counter += 1
-
-    # Iterate source data for Transfer Edges (connectedTo)
-    # for system_name, details in source_data.items():
-    #     tag_id = details.get("tagID")
-    #     connected_to_list = details.get("connectedTo", [])
-    #     for target_name in connected_to_list:
-    #         target_id = system_name_to_id.get(target_name)
-    #         if target_id:
-    #             edges.append(create_edge(tag_id, target_id, "transfer"))
-    #             edge_counter += 1
-
-    imf_content = {
-        "nodes": nodes,
-        "edges": edges
+        }, True
+
+    def iter_edges(self):
+        """
+        Yield the part (child -> parent) and fulfilled (product -> function)
+        edges of every component, then the transfer (connectedTo) edges.
+        """
+        edge_number = self.first_edge_number
+        seen = {}
+        for i, tag_id in enumerate(self.tags):
+            links = [(self.parent_ids[i], "part")] if self.parent_ids[i] != "void" else []
+            links += [(func_id, "fulfilled") for func_id in self.func_ids[i]]
+            for target, edge_type in links:
+                edge, is_new = self._edge(edge_number, tag_id, target, edge_type, seen)
+                if is_new:
+                    edge_number += 1
+                yield edge
+
+        for source_id, target_id in self.transfers:
+            edge, is_new = self._edge(edge_number, source_id, target_id, "transfer", seen)
+            if is_new:
+                edge_number += 1
+            yield edge
+
+
+def build_imf(source_data):
+    """
+    Build the IMF content ({"nodes": [...], "edges": [...]}) for a JSON system
+    description in memory. Runs in time linear in the number of components,
+    functions and edges.
+    """
+    plan = ImfPlan(source_data)
+    return {
+        "nodes": list(plan.iter_nodes()),
+        "edges": list(plan.iter_edges())
     }
 
-    with open(output_path, 'w') as f:
-        json.dump(imf_content, f, indent=2)
-    
+
+def write_imf(f, nodes, edges, compact=False):
+    """
+    Write IMF nodes and edges, given as iterables, to the text file f one
+    element at a time. The indented output is identical to
+    json.dump(..., indent=2); compact output has no whitespace at all.
+    Returns the number of nodes and edges written.
+    """
+    if compact:
+        head, between, tail = '{"nodes":', ',"edges":', '}'
+        item_prefix, list_end = '', ']'
+
+        def dump(element):
+            return json.dumps(element, separators=(',', ':'))
+    else:
+        head, between, tail = '{\n  "nodes": ', ',\n  "edges": ', '\n}'
+        item_prefix, list_end = '\n    ', '\n  ]'
+
+        def dump(element):
+            return json.dumps(element, indent=2).replace('\n', '\n    ')
+
+    f.write(head)
+    counts = []
+    for elements in (nodes, edges):
+        if elements is edges:
+            f.write(between)
+        count = 0
+        for element in elements:
+            f.write(('[' if count == 0 else ',') + item_prefix + dump(element))
+            count += 1
+        f.write('[]' if count == 0 else list_end)
+        counts.append(count)
+    f.write(tail)
+    return counts[0], counts[1]
+
+
+def load_imf(path):
+    """Read an IMF file, gzip-compressed or not."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return json.load(f)
+
+
+def convert_json_to_imf(input_path, output_path, compact=False, gzip_output=None, previous_path=None):
+    """
+    Converts a JSON system description to an IMF file format.
+
+    With previous_path, the IMF file previously generated from this system,
+    the conversion is incremental: unchanged components keep their ids,
+    labels, positions and timestamps (see ImfPlan).
+
+    Nodes and edges are streamed to the output file, so the full IMF content
+    is never held in memory. compact=True writes no indentation, and the
+    output is gzip-compressed when gzip_output is true (by default, when
+    output_path ends in .gz). Returns the number of nodes and edges written.
+    """
+
+    counts = _convert(input_path, output_path, compact, gzip_output, previous_path)
+    if counts is not None:
+        print(f"Generated IMF file at: {output_path}")
+    return counts
+
+def _convert(input_path, output_path, compact, gzip_output, previous_path):
+    if not os.path.exists(input_path):
+        print(f"Error: Input file not found at {input_path}")
+        return None
+
+    with open(input_path, 'r') as f:
+        source_data = json.load(f)
+
+    previous = None
+    if previous_path and os.path.exists(previous_path):
+        previous = load_imf(previous_path)
+
+    plan = ImfPlan(source_data, previous)
+
+    if gzip_output is None:
+        gzip_output = output_path.endswith('.gz')
+    opener = gzip.open if gzip_output else open
+    with opener(output_path, 'wt') as f:
+        return write_imf(f, plan.iter_nodes(), plan.iter_edges(), compact)
+
+def _create_temp(path):
+    # A new, empty file next to path. Unlike mkstemp (always 0600) it gets the
+    # permissions open() would give, as the umask allows.
+    while True:
+        tmp_path = f"{path}.{os.urandom(6).hex()}.tmp"
+        try:
+            return os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), tmp_path
+        except FileExistsError:
+            continue
+
+def convert_to_file(input_path, output_path, compact=False, gzip_output=None, previous_path=None):
+    """
+    convert_json_to_imf() through a temporary file that replaces output_path
+    only once it is complete, so readers never see a half-written IMF file.
+    Raises FileNotFoundError if input_path does not exist.
+    """
+    if gzip_output is None:
+        gzip_output = output_path.endswith('.gz')
+    fd, tmp_path = _create_temp(output_path)
+    os.close(fd)
+    try:
+        counts = _convert(input_path, tmp_path, compact, gzip_output, previous_path)
+        if counts is None:
+            raise FileNotFoundError(input_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     print(f"Generated IMF file at: {output_path}")
+    return counts
+
+
+# Batch conversion (command line)
+
+MANIFEST_NAME = '.imf_manifest.json'
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def find_inputs(patterns):
+    """
+    Expand files, directories and glob patterns to JSON system descriptions.
+    Directories and glob patterns contribute their *.json files except the
+    *_components.json partonomies written next to them; a file named
+    explicitly is always taken.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, f) for f in sorted(os.listdir(pattern))
+                       if f.endswith('.json') and not f.endswith('_components.json')]
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = [f for f in sorted(glob.glob(pattern)) if not f.endswith('_components.json')]
+            if not matches:
+                print(f"Warning: nothing matches {pattern}")
+        for path in matches:
+            if os.path.isfile(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _is_up_to_date(input_path, output_path, entry, compact):
+    # A newer output is trusted; an older one is only if the input bytes did not change
+    if not os.path.exists(output_path) or (entry is not None and entry.get("compact") != compact):
+        return False
+    if os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+        return True
+    if entry is not None and entry.get("sha256") == _sha256(input_path):
+        os.utime(output_path)
+        return True
+    return False
+
+
+def _convert_job(input_path, output_path, compact, incremental):
+    # Runs in a worker process
+    start = time.perf_counter()
+    try:
+        digest = _sha256(input_path)
+        counts = convert_to_file(input_path, output_path, compact,
+                                 previous_path=output_path if incremental else None)
+        return input_path, output_path, digest, counts[0], counts[1], time.perf_counter() - start, None
+    except Exception as e:
+        return input_path, output_path, None, 0, 0, time.perf_counter() - start, str(e)
+
+
+def _write_manifest(path, manifest):
+    fd, tmp_path = _create_temp(path)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def convert_many(input_paths, output_folder, workers=None, compact=False, gzip_output=False,
+                 incremental=False, force=False):
+    """
+    Convert JSON system descriptions to <output_folder>/<name>.imf[.gz] in a
+    process pool, skipping outputs that are up to date. The input hash of
+    every output is kept in a manifest in output_folder, so an input that was
+    touched but not changed is not converted again.
+
+    Returns (converted, skipped, failed, nodes, edges, seconds).
+    """
+    start = time.perf_counter()
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    suffix = '.imf.gz' if gzip_output else '.imf'
+    jobs = []
+    skipped = 0
+    outputs = set()
+    for input_path in input_paths:
+        output_name = os.path.splitext(os.path.basename(input_path))[0] + suffix
+        output_path = os.path.join(output_folder, output_name)
+        if output_path in outputs:
+            print(f"Warning: skipping {input_path}, another input is also converted to {output_path}")
+            continue
+        outputs.add(output_path)
+        if not force and _is_up_to_date(input_path, output_path, manifest.get(output_name), compact):
+            skipped += 1
+            continue
+        jobs.append((input_path, output_path, compact, incremental))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        results = [_convert_job(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_convert_job, *job) for job in jobs]
+            results = [future.result() for future in as_completed(futures)]
+
+    converted = failed = nodes = edges = 0
+    for input_path, output_path, digest, n_nodes, n_edges, seconds, error in results:
+        if error is not None:
+            failed += 1
+            print(f"Error: {input_path}: {error}")
+            continue
+        converted += 1
+        nodes += n_nodes
+        edges += n_edges
+        manifest[os.path.basename(output_path)] = {"source": input_path, "sha256": digest, "compact": compact}
+    if results:
+        _write_manifest(manifest_path, manifest)
+
+    return converted, skipped, failed, nodes, edges, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert JSON system descriptions to IMF files.")
+    parser.add_argument('inputs', nargs='*', default=['processed_data'],
+                        help="JSON files, directories or glob patterns (default: processed_data)")
+    parser.add_argument('-o', '--output', default='imf_data', help="output folder (default: imf_data)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument('--compact', action='store_true', help="write without indentation")
+    parser.add_argument('--gzip', action='store_true', help="write gzip-compressed .imf.gz files")
+    parser.add_argument('--incremental', action='store_true',
+                        help="keep ids, labels and positions of the existing output files")
+    parser.add_argument('--force', action='store_true', help="convert even if the output is up to date")
+    args = parser.parse_args(argv)
+
+    input_paths = find_inputs(args.inputs)
+    converted, skipped, failed, nodes, edges, seconds = convert_many(
+        input_paths, args.output, args.workers, args.compact, args.gzip, args.incremental, args.force)
+
+    rate = 1 / seconds if seconds > 0 else 0
+    print(f"Converted {converted} files ({skipped} up to date, {failed} failed) in {seconds:.2f}s: "
+          f"{converted * rate:.1f} files/s, {nodes * rate:.0f} nodes/s, {edges * rate:.0f} edges/s")
+    return 1 if failed else 0
+
 
 if __name__ == "__main__":
-    input_json = "/Users/yanzho/Codes/SIM/processed_data/PATENT_gas_cooling_system.json"
-    output_imf = "/Users/yanzho/Codes/SIM/converted_gas_cooling_system.imf"
-    convert_json_to_imf(input_json, output_imf)
\ No newline at end of file
+    sys.exit(main())
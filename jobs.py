@@ -0,0 +1,202 @@
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Fixed-size pool of worker threads fed from a bounded FIFO queue.
+
+    submit() raises QueueFullError instead of blocking when max_queued jobs are
+    already waiting, so callers can push back on clients. Jobs that have not
+    started yet can be looked up by position and cancelled.
+    """
+
+    def __init__(self, workers=2, max_queued=20):
+        self.max_queued = max_queued
+        self._pending = deque()
+        self._running = set()
+        self._cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True).start()
+
+    def submit(self, job_id, fn, *args):
+        with self._cond:
+            if len(self._pending) >= self.max_queued:
+                raise QueueFullError(f'{len(self._pending)} jobs already queued')
+            self._pending.append((job_id, fn, args))
+            self._cond.notify()
+
+    def position(self, job_id):
+        """1-based position of a waiting job, or None if it is not waiting."""
+        with self._cond:
+            for i, (pending_id, _, _) in enumerate(self._pending):
+                if pending_id == job_id:
+                    return i + 1
+        return None
+
+    def cancel(self, job_id):
+        """Remove a waiting job. Returns False if it already started or is unknown."""
+        with self._cond:
+            for job in self._pending:
+                if job[0] == job_id:
+                    self._pending.remove(job)
+                    return True
+        return False
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def full(self):
+        """True if submit() would raise QueueFullError now."""
+        with self._cond:
+            return len(self._pending) >= self.max_queued
+
+    def running(self):
+        with self._cond:
+            return len(self._running)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job_id, fn, args = self._pending.popleft()
+                self._running.add(job_id)
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(job_id)
+
+
+class MemoryStatusStore:
+    """
+    Task status kept in this process, evicting entries older than ttl seconds
+    and the least recently updated ones beyond max_entries.
+    """
+
+    def __init__(self, ttl=24 * 3600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # task_id -> (updated, status), oldest first
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def __setitem__(self, task_id, status):
+        now = time.time()
+        with self._lock:
+            self._data.pop(task_id, None)
+            self._data[task_id] = (now, status)
+            while self._data:
+                oldest_id, (updated, _) = next(iter(self._data.items()))
+                if len(self._data) <= self.max_entries and updated >= now - self.ttl:
+                    break
+                del self._data[oldest_id]
+            self._changed.notify_all()
+
+    def wait_for_update(self, timeout):
+        """Block until any status is set or timeout seconds pass."""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def get(self, task_id, default=None):
+        with self._lock:
+            entry = self._data.get(task_id)
+        if entry is None or entry[0] < time.time() - self.ttl:
+            return default
+        return entry[1]
+
+    def pop(self, task_id, default=None):
+        with self._lock:
+            entry = self._data.pop(task_id, None)
+        return default if entry is None else entry[1]
+
+    def __getitem__(self, task_id):
+        status = self.get(task_id)
+        if status is None:
+            raise KeyError(task_id)
+        return status
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SqliteStatusStore(MemoryStatusStore):
+    """
+    Task status in an SQLite file, shared by every process on the host and
+    kept across restarts. Expired rows are purged at most once a minute.
+    """
+
+    PURGE_INTERVAL = 60
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, path, ttl=24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._last_purge = 0
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS task_status '
+                         '(task_id TEXT PRIMARY KEY, status TEXT NOT NULL, updated REAL NOT NULL)')
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call is safe across threads and processes
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def __setitem__(self, task_id, status):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO task_status VALUES (?, ?, ?)',
+                         (task_id, json.dumps(status), now))
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._last_purge = now
+                conn.execute('DELETE FROM task_status WHERE updated < ?', (now - self.ttl,))
+
+    def wait_for_update(self, timeout):
+        # Writes may come from other processes, so there is nothing to wait on
+        time.sleep(min(timeout, self.POLL_INTERVAL))
+
+    def get(self, task_id, default=None):
+        with self._connect() as conn:
+            row = conn.execute('SELECT status FROM task_status WHERE task_id = ? AND updated >= ?',
+                               (task_id, time.time() - self.ttl)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def pop(self, task_id, default=None):
+        status = self.get(task_id, default)
+        with self._connect() as conn:
+            conn.execute('DELETE FROM task_status WHERE task_id = ?', (task_id,))
+        return status
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*) FROM task_status').fetchone()[0]
+
+
+def make_status_store(backend, path=None, ttl=24 * 3600, max_entries=10000):
+    if backend == 'memory':
+        return MemoryStatusStore(ttl, max_entries)
+    if backend == 'sqlite':
+        return SqliteStatusStore(path, ttl)
+    raise ValueError(f"Unknown status backend: {backend}")
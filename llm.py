@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import random
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class GeminiClient:
+    """Thin wrapper around a Gemini model so callers do not depend on the SDK."""
+
+    def __init__(self, model_name='gemini-2.5-pro', api_key=None):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key or os.getenv("GOOGLE_API_KEY"))
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self._model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        """Yield the response text piece by piece as the model produces it."""
+        for chunk in self._model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeClient:
+    """
+    Deterministic stand-in for GeminiClient that never leaves the process.
+
+    Every call takes `latency` seconds. The partonomy and relations prompts
+    of process_pdf_task are answered with a synthetic model, seeded by the
+    prompt, so uploads run end to end offline; other prompts get `response`.
+    With response_chars, answers are grown to about that many characters.
+    """
+
+    def __init__(self, response="This is a fake answer.", model_name='fake', latency=0.0, response_chars=None):
+        self.model_name = model_name
+        self.response = response
+        self.latency = latency
+        self.response_chars = response_chars
+
+    def _answer(self, prompt):
+        rng = random.Random(hashlib.sha256(prompt.encode('utf-8')).hexdigest())
+        size = self.response_chars or 0
+        if '"system_name"' in prompt:
+            return self._partonomy(rng, max(1, size // 40))
+        if 'component_dict:' in prompt:
+            return self._relations(rng, max(1, size // 160))
+        answer = self.response
+        while len(answer) < size:
+            answer += ' ' + self.response
+        return answer
+
+    @staticmethod
+    def _partonomy(rng, n):
+        components = {}
+        for i in range(n):
+            subcomponents = {f"part {i}.{j}_P{i}{j}": [] for j in range(rng.randrange(3))}
+            components[f"component {i}_C{i}"] = subcomponents
+        return "```json\n" + json.dumps({"Fake system_S0": components}) + "\n```"
+
+    @staticmethod
+    def _relations(rng, n):
+        names = ["Fake system_S0"] + [f"component {rng.randrange(10 * n)}_C{i}" for i in range(n)]
+        model = {}
+        for i, name in enumerate(names):
+            model[name] = {
+                "tagID": name.rsplit('_', 1)[1],
+                "partOf": [] if i == 0 else [names[0]],
+                "connectedTo": [names[rng.randrange(1, len(names))] for _ in range(rng.randrange(3))] if i else [],
+                "fulfills": [f"function {rng.randrange(100)}" for _ in range(rng.randrange(3))],
+                "hasTerminal": [f"terminal {rng.randrange(100)}" for _ in range(rng.randrange(2))],
+            }
+        return json.dumps(model, indent=4)
+
+    def generate(self, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._answer(prompt)
+
+    def stream(self, prompt):
+        words = self._answer(prompt).split(' ')
+        for word in words:
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield word + ' '
+
+
+def make_client(backend, model_name=None, latency=0.0, response_chars=None):
+    """Model client for an LLM_BACKEND setting: 'gemini' or 'fake'."""
+    if backend == 'gemini':
+        return GeminiClient(model_name or 'gemini-2.5-pro')
+    if backend == 'fake':
+        return FakeClient(model_name=model_name or 'fake', latency=latency, response_chars=response_chars)
+    raise ValueError(f"Unknown LLM backend: {backend}")
+
+
+def generate_with_retry(client, prompt, retries=3, backoff=2.0):
+    """Call client.generate, retrying failures with exponential backoff and jitter."""
+    for attempt in range(retries + 1):
+        try:
+            return client.generate(prompt)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            print(f"LLM call failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def map_concurrently(fn, items, concurrency=4, on_done=None):
+    """
+    Call fn on every item with at most `concurrency` calls in flight.
+
+    Returns the results in the order of `items`. on_done, if given, is called
+    as on_done(done_count, total) after each call finishes.
+    """
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(fn, item): i for i, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if on_done:
+                on_done(done, len(items))
+    return results
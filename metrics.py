@@ -0,0 +1,106 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the timing histogram buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    items = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for k, v in labels)
+    return '{' + items + '}'
+
+
+class Metrics:
+    """
+    Counters, gauges and timing histograms kept in this process and rendered
+    in the Prometheus text format.
+
+    Metrics are declared with describe() and created on first use, one
+    series per label combination. Gauges can also be read from a callback at
+    render time, e.g. the length of a queue.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._types = {}  # name -> (type, help)
+        self._values = {}  # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+        self._callbacks = []  # (name, fn, labels)
+        self._lock = threading.Lock()
+
+    def describe(self, name, metric_type, help_text):
+        self._types[name] = (metric_type, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def gauge_callback(self, name, fn, **labels):
+        """Report fn() as the value of gauge (or counter) name at render time."""
+        self._callbacks.append((name, fn, tuple(sorted(labels.items()))))
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    @contextmanager
+    def timer(self, name, record=None, **labels):
+        """
+        Time the block into histogram name. If record (a dict) is given, the
+        seconds are also added to record[labels['stage']], or record[name].
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(name, elapsed, **labels)
+            if record is not None:
+                key = labels.get('stage', name)
+                with self._lock:
+                    record[key] = round(record.get(key, 0) + elapsed, 4)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+            values = {key: [list(v[0]), v[1], v[2]] if isinstance(v, list) else v for key, v in values.items()}
+        for name, fn, labels in self._callbacks:
+            try:
+                values[(name, labels)] = fn()
+            except Exception:
+                continue
+
+        by_name = {}
+        for (name, labels), value in values.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            full_name = self.prefix + name
+            metric_type, help_text = self._types.get(name, ('untyped', ''))
+            if help_text:
+                lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric_type}')
+            for labels, value in sorted(by_name[name]):
+                if metric_type != 'histogram':
+                    lines.append(f'{full_name}{_label_text(labels)} {value}')
+                    continue
+                buckets, total, count = value
+                for bound, bucket_count in zip(BUCKETS, buckets):
+                    lines.append(f'{full_name}_bucket{_label_text(labels + (("le", bound),))} {bucket_count}')
+                lines.append(f'{full_name}_bucket{_label_text(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{full_name}_sum{_label_text(labels)} {total}')
+                lines.append(f'{full_name}_count{_label_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
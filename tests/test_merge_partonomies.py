@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import merge_partonomies
+
+
+def test_null_leaf_then_subtree():
+    merged = merge_partonomies([{"S_1": {"pump_P1": None}}, {"S_1": {"pump_P1": {"x_1": []}}}])
+    assert merged == {"S_1": {"pump_P1": {"x_1": []}}}
+
+
+def test_string_leaf_then_subtree():
+    merged = merge_partonomies([{"S_1": {"pump_P1": "none"}}, {"S_1": {"pump_P1": {"x_1": []}}}])
+    assert merged == {"S_1": {"pump_P1": {"x_1": []}}}
+
+
+def test_null_and_string_leaves_become_empty():
+    merged = merge_partonomies([{"S_1": None}, {"S_1": {"pump_P1": "n/a", "tank_T2": None}}])
+    assert merged == {"S_1": {"pump_P1": {}, "tank_T2": {}}}
+
+
+def test_same_tag_under_another_name_is_merged():
+    merged = merge_partonomies([
+        {"Cooling system_A001": {"pump system_B22": {"pump_B223": ["s1"]}}},
+        {"Cooling_A001": {"Pump System_B22": {"pump_B223": ["s2"], "motor_B224": []}}},
+    ])
+    assert merged == {"Cooling system_A001": {"pump system_B22": {"pump_B223": ["s1", "s2"], "motor_B224": []}}}
@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils import repair_json, parse_json
+
+
+def test_valid_json_needs_no_repair():
+    assert repair_json('{"a": [1, 2], "b": {"c": null}}') == ({"a": [1, 2], "b": {"c": None}}, [])
+
+
+def test_code_fence_and_surrounding_text_are_not_repairs():
+    assert repair_json('Here it is:\n```json\n{"a": 1}\n```\nDone.') == ({"a": 1}, [])
+
+
+def test_no_object():
+    assert repair_json("no JSON here")[0] is None
+    assert parse_json("no JSON here") == {}
+
+
+def test_missing_comma_between_strings_in_list():
+    assert repair_json('{"a": ["x" "y"]}')[0] == {"a": ["x", "y"]}
+
+
+def test_missing_comma_between_members():
+    assert repair_json('{"a": "x" "b": "y"}')[0] == {"a": "x", "b": "y"}
+    assert repair_json('{"S":{"tagID": "JG1" "partOf": []}}')[0] == {"S": {"tagID": "JG1", "partOf": []}}
+
+
+def test_missing_comma_at_line_end():
+    assert repair_json('{"a": 1\n "b": [1\n 2]}')[0] == {"a": 1, "b": [1, 2]}
+
+
+def test_trailing_and_extra_commas():
+    assert repair_json('{"a": [1, 2,], "b": 3,,}')[0] == {"a": [1, 2], "b": 3}
+
+
+def test_missing_colon():
+    assert repair_json('{"a" "x", "b" "y"}')[0] == {"a": "x", "b": "y"}
+
+
+def test_comments_and_ellipsis():
+    text = '{"a": [x, ...], # comment\n "b": 1, // another\n}'
+    assert repair_json(text)[0] == {"a": ["x"], "b": 1}
+
+
+def test_bare_words_and_single_quotes():
+    assert repair_json("{'a': cooling, 'b': True}")[0] == {"a": "cooling", "b": True}
+
+
+def test_quotes_and_newlines_inside_strings():
+    assert repair_json('{"a": "he said "hi" there"}')[0] == {"a": 'he said "hi" there'}
+    assert repair_json('{"a": "line one\nline two"}')[0] == {"a": "line one\nline two"}
+
+
+def test_mismatched_brackets():
+    assert repair_json('{"a": [1, 2}')[0] == {"a": [1, 2]}
+
+
+def test_truncated_output():
+    assert repair_json('{"a": {"b": ["x", "y')[0] == {"a": {"b": ["x", "y"]}}
+    assert repair_json('{"a": {"b": ')[0] == {"a": {"b": None}}
@@ -0,0 +1,981 @@
+import os
+import re
+import json
+import math
+import shutil
+import hashlib
+import threading
+import tempfile
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from PyPDF2 import PdfReader
+
+# Below this many pages the cost of sending batches to worker processes outweighs the gain
+PARALLEL_MIN_PAGES = 16
+
+# One pool per worker count, shared by all uploads and kept for the life of the process
+_extract_pools = {}
+_extract_pools_lock = threading.Lock()
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _extract_page_range(pdf_path, start, stop):
+    # Runs in a worker process: each worker opens its own reader
+    with open(pdf_path, 'rb') as f:
+        reader = PdfReader(f)
+        return start, [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _extract_pool(workers):
+    # Workers are not forked from the (multi-threaded) server: they are
+    # started by a fork server, or spawned where there is none
+    with _extract_pools_lock:
+        pool = _extract_pools.get(workers)
+        if pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            pool = _extract_pools[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context(method))
+        return pool
+
+
+def extract_pages(pdf_path, workers=1, progress=None):
+    """
+    Extract the text of every page of a PDF, in page order.
+
+    With workers > 1 the pages are split into batches extracted in a process
+    pool of that many workers, shared by all calls. progress, if given, is
+    called as progress(pages_done, total_pages).
+    """
+    with open(pdf_path, 'rb') as f:
+        total = len(PdfReader(f).pages)
+
+    if workers <= 1 or total < PARALLEL_MIN_PAGES:
+        pages = []
+        with open(pdf_path, 'rb') as f:
+            reader = PdfReader(f)
+            for page in reader.pages:
+                pages.append(page.extract_text() or "")
+                if progress:
+                    progress(len(pages), total)
+        return pages
+
+    batch = max(1, min(25, total // (workers * 4)))
+    pages = [None] * total
+    done = 0
+    pool = _extract_pool(workers)
+    try:
+        futures = [pool.submit(_extract_page_range, pdf_path, start, min(start + batch, total))
+                   for start in range(0, total, batch)]
+        for future in as_completed(futures):
+            start, texts = future.result()
+            pages[start:start + len(texts)] = texts
+            done += len(texts)
+            if progress:
+                progress(done, total)
+    except BrokenProcessPool:
+        # A worker died; start a new pool for the next document
+        with _extract_pools_lock:
+            if _extract_pools.get(workers) is pool:
+                del _extract_pools[workers]
+        raise
+    return pages
+
+
+def _write_json_atomic(path, data):
+    # Write to a temp file in the same folder and rename, so readers in other
+    # threads/processes never see a half-written file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def evict_lru(folder, max_bytes, suffix='.json'):
+    """
+    Delete the least recently used entries ending in suffix in folder (by
+    mtime) until their total size is at most max_bytes. index.json is never
+    removed. Returns the total size of the entries left.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(folder):
+        if not name.endswith(suffix) or name == 'index.json':
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+class _SizeBudget:
+    """
+    Running size of the entries of a cache folder. The folder is only listed
+    and trimmed by evict_lru when the total goes over max_bytes (or is not
+    known yet), and then down to 90% of it so the next scan is a while off.
+    Entries written by other processes are counted at the next scan.
+    """
+
+    def __init__(self, folder, max_bytes, suffix='.json'):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.total = None
+
+    def add(self, nbytes):
+        if self.total is not None and self.total + nbytes <= self.max_bytes:
+            self.total += nbytes
+            return
+        self.total = evict_lru(self.folder, self.max_bytes * 9 // 10, self.suffix)
+
+
+class PdfTextCache:
+    """
+    Persistent cache of extracted PDF text, one entry per document.
+
+    Entries are stored as <sha256>.json (a list of page texts) and keyed by the
+    SHA-256 of the PDF bytes, so a file uploaded again under the same name but
+    with different content never returns stale text. index.json remembers the
+    digest, size and mtime last seen for each filename so unchanged files are
+    not re-hashed on every lookup; it is kept in memory and only read again
+    when another process rewrites it. Filenames whose file was deleted are
+    dropped from it when a new digest is recorded. When the total size of the
+    entries exceeds max_bytes the least recently used ones are removed.
+    """
+
+    def __init__(self, cache_folder, max_bytes=512 * 1024 * 1024, workers=1):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._index_path = os.path.join(cache_folder, 'index.json')
+        self._index = {}
+        self._index_version = None
+        self._budget = _SizeBudget(cache_folder, max_bytes)
+        self._lock = threading.Lock()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    def _entry_path(self, digest):
+        return os.path.join(self.cache_folder, digest + '.json')
+
+    def _file_version(self):
+        try:
+            stat = os.stat(self._index_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _load_index(self):
+        # Called with the lock held; index.json is replaced atomically, so a
+        # new inode, mtime or size means another process wrote it
+        version = self._file_version()
+        if version != self._index_version:
+            try:
+                with open(self._index_path, 'r') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            self._index_version = version
+        return self._index
+
+    def digest(self, pdf_path):
+        """Return the SHA-256 of pdf_path, re-hashing only if its size or mtime changed."""
+        filename = os.path.basename(pdf_path)
+        stat = os.stat(pdf_path)
+        with self._lock:
+            index = self._load_index()
+            known = index.get(filename)
+            if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+                return known['sha256']
+
+        digest = file_sha256(pdf_path)
+        self._record_digest(pdf_path, stat, digest)
+        return digest
+
+    def remember_digest(self, pdf_path, digest):
+        """Record the SHA-256 of pdf_path when the caller already computed it."""
+        self._record_digest(pdf_path, os.stat(pdf_path), digest)
+
+    def _record_digest(self, pdf_path, stat, digest):
+        filename = os.path.basename(pdf_path)
+        folder = os.path.dirname(pdf_path)
+        with self._lock:
+            index = dict(self._load_index())
+            known = index.get(filename)
+            if known and known['sha256'] == digest and known['size'] == stat.st_size \
+                    and known['mtime'] == stat.st_mtime:
+                return
+            index[filename] = {'sha256': digest, 'size': stat.st_size, 'mtime': stat.st_mtime}
+            dropped = {known['sha256']} if known and known['sha256'] != digest else set()
+            for name in [name for name in index if not os.path.exists(os.path.join(folder, name))]:
+                dropped.add(index.pop(name)['sha256'])
+            # Drop the text of replaced or deleted files unless another
+            # filename still points at the same content.
+            still_used = {v['sha256'] for v in index.values()}
+            for old_digest in dropped - still_used:
+                if os.path.exists(self._entry_path(old_digest)):
+                    os.remove(self._entry_path(old_digest))
+            _write_json_atomic(self._index_path, index)
+            self._index = index
+            self._index_version = self._file_version()
+
+    def get_pages(self, pdf_path, progress=None):
+        """Return the list of page texts for pdf_path, extracting it on a miss."""
+        digest = self.digest(pdf_path)
+        entry_path = self._entry_path(digest)
+        try:
+            with open(entry_path, 'r') as f:
+                pages = json.load(f)
+            os.utime(entry_path)  # mark as recently used for eviction
+            with self._lock:
+                self.hits += 1
+            return pages
+        except (OSError, ValueError):
+            pass
+
+        pages = extract_pages(pdf_path, self.workers, progress)
+        with self._lock:
+            self.misses += 1
+            _write_json_atomic(entry_path, pages)
+            self._budget.add(os.path.getsize(entry_path))
+        return pages
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+class ResponseCache:
+    """
+    Disk cache of model responses, one <key>.json file per response.
+
+    Keys are built from the model name, the version of the prompt template,
+    the hash of the document and the question (or other varying input), so a
+    changed prompt or document never hits an old answer. Entries are evicted
+    least recently used first once they exceed max_bytes.
+    """
+
+    def __init__(self, cache_folder, max_bytes=256 * 1024 * 1024):
+        self.cache_folder = cache_folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._budget = _SizeBudget(cache_folder, max_bytes)
+        self._lock = threading.Lock()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    @staticmethod
+    def key(model_name, template_version, doc_hash, question=''):
+        raw = json.dumps([model_name, template_version, doc_hash, question])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.cache_folder, key + '.json')
+        try:
+            with open(path, 'r') as f:
+                response = json.load(f)['response']
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return response
+
+    def put(self, key, response):
+        if self.max_bytes <= 0:
+            return
+        path = os.path.join(self.cache_folder, key + '.json')
+        with self._lock:
+            _write_json_atomic(path, {'response': response})
+            self._budget.add(os.path.getsize(path))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+class ContentStore:
+    """
+    Uploaded files stored once per content, as <sha256><suffix> in folder.
+
+    save() streams a file to disk in chunks while hashing it, so an upload is
+    never held in memory whole, and content uploaded again is not stored
+    twice. <sha256>.json next to each file records what was derived from it,
+    e.g. the processed JSON file, so a repeated upload can reuse it.
+
+    Names are hard links to the stored file, so release() can tell when no
+    name uses some content any more and delete it. save() stores the content
+    and links its name in one step, so a concurrent release() never finds
+    it unused in between. Where hard links are not supported names are
+    copies, and released content is always deleted.
+    """
+
+    def __init__(self, folder, suffix='.pdf', chunk_size=1024 * 1024):
+        self.folder = folder
+        self.suffix = suffix
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.folder, digest + self.suffix)
+
+    def save(self, stream, dest_path):
+        """
+        Copy the file-like stream into the store, make dest_path a hard link
+        to it (a copy where links are not supported) and return its SHA-256.
+        """
+        h = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in iter(lambda: stream.read(self.chunk_size), b''):
+                    h.update(block)
+                    f.write(block)
+            digest = h.hexdigest()
+            with self._lock:
+                if os.path.exists(self.path(digest)):
+                    os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path, self.path(digest))
+                self._link(digest, dest_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest
+
+    def _link(self, digest, dest_path):
+        if os.path.exists(dest_path) and os.path.samefile(dest_path, self.path(digest)):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix='.tmp')
+        os.close(fd)
+        os.remove(tmp_path)
+        try:
+            os.link(self.path(digest), tmp_path)
+        except OSError:
+            shutil.copyfile(self.path(digest), tmp_path)
+        os.replace(tmp_path, dest_path)
+
+    def release(self, digest):
+        """Delete the stored content and its metadata if no name links to it any more."""
+        with self._lock:
+            try:
+                if os.stat(self.path(digest)).st_nlink > 1:
+                    return
+            except OSError:
+                return
+            for path in (self.path(digest), os.path.join(self.folder, digest + '.json')):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get_meta(self, digest):
+        try:
+            with open(os.path.join(self.folder, digest + '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def set_meta(self, digest, **values):
+        with self._lock:
+            meta = self.get_meta(digest)
+            meta.update(values)
+            _write_json_atomic(os.path.join(self.folder, digest + '.json'), meta)
+
+
+class FileListing:
+    """
+    Cached, sorted listing of the files in a folder ending in suffix (minus
+    those ending in exclude_suffix).
+
+    The folder is listed again only after invalidate() or when its
+    modification time changes, e.g. when another process adds a file, so
+    repeated page loads cost one stat.
+    """
+
+    def __init__(self, folder, suffix='.json', exclude_suffix='_components.json'):
+        self.folder = folder
+        self.suffix = suffix
+        self.exclude_suffix = exclude_suffix
+        self._names = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+
+    def names(self):
+        mtime = os.stat(self.folder).st_mtime_ns
+        with self._lock:
+            if self._names is None or self._mtime != mtime:
+                self._names = sorted(name for name in os.listdir(self.folder)
+                                     if name.endswith(self.suffix) and not name.endswith(self.exclude_suffix))
+                self._mtime = mtime
+            return self._names
+
+    def page(self, offset=0, limit=100, query=''):
+        """Return (total, names) for one page of the names containing query."""
+        names = self.names()
+        if query:
+            query = query.lower()
+            names = [name for name in names if query in name.lower()]
+        return len(names), names[offset:offset + limit]
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def chunk_pages(pages, chunk_size=1500, overlap=200):
+    """
+    Split page texts into overlapping chunks of at most chunk_size characters.
+
+    Chunks never span pages, so each one keeps the page number it came from
+    for citations.
+    """
+    chunks = []
+    for page_no, text in enumerate(pages, 1):
+        start = 0
+        while start < len(text):
+            end = min(len(text), start + chunk_size)
+            chunks.append({'page': page_no, 'text': text[start:end]})
+            if end == len(text):
+                break
+            start = end - overlap
+    return chunks
+
+
+# Rough size of a model token in characters of English text, used to budget prompts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def budget_chunks(pages, max_tokens):
+    """
+    Group page texts into consecutive chunks of at most max_tokens estimated
+    tokens each. Pages are kept whole unless a single page exceeds the
+    budget, in which case it is cut.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    current = []
+    size = 0
+    for text in pages:
+        for start in range(0, max(len(text), 1), max_chars):
+            piece = text[start:start + max_chars]
+            if current and size + len(piece) > max_chars:
+                chunks.append("".join(current))
+                current = []
+                size = 0
+            current.append(piece)
+            size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+class BM25Scorer:
+    """Lexical Okapi BM25 scorer; needs no model or network access."""
+
+    name = 'bm25'
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def build(self, texts):
+        postings = {}
+        lengths = []
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([i, tf])
+        return {'postings': postings, 'lengths': lengths}
+
+    def score(self, state, query):
+        lengths = state['lengths']
+        n = len(lengths)
+        avgdl = (sum(lengths) / n) if n else 0
+        scores = [0.0] * n
+        for term in set(tokenize(query)):
+            postings = state['postings'].get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = tf + self.k1 * (1 - self.b + self.b * lengths[i] / (avgdl or 1))
+                scores[i] += idf * tf * (self.k1 + 1) / norm
+        return scores
+
+
+class EmbeddingScorer:
+    """
+    Cosine-similarity scorer over dense vectors.
+
+    embed_fn takes a list of strings and returns a list of vectors, so any local
+    or remote embedding model can be plugged in.
+    """
+
+    def __init__(self, embed_fn, name='embedding'):
+        self.embed_fn = embed_fn
+        self.name = name
+
+    @staticmethod
+    def _normalize(vector):
+        length = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / length for x in vector]
+
+    def build(self, texts):
+        return {'vectors': [self._normalize(v) for v in self.embed_fn(texts)]}
+
+    def score(self, state, query):
+        q = self._normalize(self.embed_fn([query])[0])
+        return [sum(a * b for a, b in zip(q, v)) for v in state['vectors']]
+
+
+class ChunkIndex:
+    """Chunks of one document plus the scorer state needed to search them."""
+
+    def __init__(self, chunks, scorer, state):
+        self.chunks = chunks
+        self.scorer = scorer
+        self.state = state
+
+    @classmethod
+    def build(cls, pages, scorer, chunk_size=1500, overlap=200):
+        chunks = chunk_pages(pages, chunk_size, overlap)
+        return cls(chunks, scorer, scorer.build([c['text'] for c in chunks]))
+
+    def save(self, path):
+        _write_json_atomic(path, {'scorer': self.scorer.name, 'chunks': self.chunks, 'state': self.state})
+
+    @classmethod
+    def load(cls, path, scorer):
+        """Load a saved index, or return None if missing or built with another scorer."""
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('scorer') != scorer.name:
+            return None
+        return cls(data['chunks'], scorer, data['state'])
+
+    def search(self, question, k=5):
+        """Return the k best matching chunks, in document order."""
+        scores = self.scorer.score(self.state, question)
+        best = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+        return [self.chunks[i] for i in sorted(best) if scores[i] > 0] or self.chunks[:k]
+
+
+def get_pdf_vector(pages, index_path, scorer=None):
+    """Load the chunk index stored at index_path, building and saving it if needed."""
+    scorer = scorer or BM25Scorer()
+    index = ChunkIndex.load(index_path, scorer)
+    if index is None:
+        index = ChunkIndex.build(pages, scorer)
+        index.save(index_path)
+    return index
+
+
+def split_component_dict(component_dict):
+    """
+    Split a partonomy into the system itself plus one subtree per top-level
+    component, so each part can be sent to the model separately.
+    """
+    if not isinstance(component_dict, dict) or len(component_dict) != 1:
+        return [component_dict]
+    system_name, components = next(iter(component_dict.items()))
+    if not isinstance(components, dict) or len(components) < 2:
+        return [component_dict]
+    return [{system_name: {}}] + [{system_name: {name: sub}} for name, sub in components.items()]
+
+
+def component_tag(name):
+    """The tagID suffix of a partonomy key such as "pump system_B22", or None."""
+    if not isinstance(name, str) or '_' not in name:
+        return None
+    tag = name.rsplit('_', 1)[1].strip()
+    return tag if any(ch.isdigit() for ch in tag) else None
+
+
+def _index_tags(items, holder, by_tag):
+    for name, value in items.items():
+        tag = component_tag(name)
+        if tag is not None:
+            by_tag.setdefault(tag, holder)
+        if isinstance(value, dict):
+            _index_tags(value, value, by_tag)
+
+
+def _partonomy_value(value):
+    # A copy of value in which anything but a dict or a list, e.g. a null or
+    # string leaf from the model, becomes an empty dict
+    if isinstance(value, dict):
+        return {name: _partonomy_value(v) for name, v in value.items()}
+    if isinstance(value, list):
+        return list(value)
+    return {}
+
+
+def _merge_partonomy_into(target, source, by_tag, path=()):
+    # by_tag: tagID -> the dict holding the key with that tag, shared by all
+    # levels; path: ids of the dicts from the root down to target
+    path = path + (id(target),)
+    for name, value in source.items():
+        tag = component_tag(name)
+        holder, key = target, name
+        if name not in target and tag is not None and tag in by_tag:
+            tagged = next(k for k in by_tag[tag] if component_tag(k) == tag)
+            # A component is never merged into one of its own ancestors
+            if id(by_tag[tag][tagged]) not in path:
+                holder, key = by_tag[tag], tagged
+        if key not in holder:
+            holder[key] = _partonomy_value(value)
+            _index_tags({key: holder[key]}, holder, by_tag)
+            continue
+        existing = holder[key]
+        if not isinstance(existing, (dict, list)):
+            existing = holder[key] = {}
+        if isinstance(existing, list) and isinstance(value, list):
+            holder[key] = existing + [v for v in value if v not in existing]
+            continue
+        # A list of sub-subcomponents is the leaf form of a dict of them
+        if isinstance(existing, list):
+            existing = holder[key] = {v: [] for v in existing if isinstance(v, str)}
+        if isinstance(value, list):
+            value = {v: [] for v in value if isinstance(v, str)}
+        if isinstance(value, dict):
+            _merge_partonomy_into(existing, value, by_tag, path)
+
+
+def merge_partonomies(partial_dicts):
+    """
+    Merge the partonomies extracted from chunks of one document.
+
+    Components are matched by their tagID suffix wherever they appear, so a
+    component found in several chunks is kept once, at its first position,
+    with the union of its subcomponents. If every chunk names a single
+    system, they are taken to be the same system under the first name.
+    """
+    partials = [p for p in partial_dicts if isinstance(p, dict) and p]
+    if partials and all(len(p) == 1 for p in partials):
+        system_name = next(iter(partials[0]))
+        partials = [{system_name: next(iter(p.values()))} for p in partials]
+    merged = {}
+    by_tag = {}
+    for partial in partials:
+        _merge_partonomy_into(merged, partial, by_tag)
+    return merged
+
+
+def merge_relations(partial_dicts, by_tag=False):
+    """
+    Merge information models produced for parts of a system.
+
+    A component described in several parts keeps its first tagID and the
+    union of its relation lists. With by_tag, components with the same tagID
+    under different names are merged too, under the first name.
+    """
+    merged = {}
+    tag_names = {}
+    for partial in partial_dicts:
+        if not isinstance(partial, dict):
+            continue
+        for name, details in partial.items():
+            if by_tag and name not in merged and isinstance(details, dict):
+                tag = details.get('tagID')
+                if isinstance(tag, str) and tag in tag_names:
+                    name = tag_names[tag]
+                elif isinstance(tag, str):
+                    tag_names[tag] = name
+            if name not in merged or not isinstance(merged[name], dict):
+                merged[name] = details
+                continue
+            if not isinstance(details, dict):
+                continue
+            target = merged[name]
+            for key, value in details.items():
+                if isinstance(value, list) and isinstance(target.get(key), list):
+                    target[key] = target[key] + [v for v in value if v not in target[key]]
+                elif not target.get(key):
+                    target[key] = value
+    return merged
+
+
+# Whitespace, then the next token. Well-formed keys and scalar values, and flat
+# arrays of them, that are followed by structure are matched whole and copied
+# as they are; anything else is a single character handled by repair_json.
+_JSON_STRING = r'"[^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*"'
+_JSON_SCALAR = rf'(?:{_JSON_STRING}|-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null)'
+_TOKEN = re.compile(rf"""
+    [ \t\r\n]*
+    (?:
+        (?P<key>{_JSON_STRING})[ \t\r\n]*:
+      | (?P<value>{_JSON_SCALAR}|\[[ \t\r\n]*(?:{_JSON_SCALAR}(?:[ \t\r\n]*,[ \t\r\n]*{_JSON_SCALAR})*[ \t\r\n]*)?\])
+        (?=[ \t]*[,\]}}\r\n])
+      | (?P<other>.)
+    )""", re.S | re.X)
+_STRING_RUN = re.compile(r'[^"\'\\\x00-\x1f]+')
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+_BAREWORD = re.compile(r'[^,:\[\]{}"\n]*')
+_NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?')
+_LITERALS = {'true': 'true', 'false': 'false', 'null': 'null',
+             'True': 'true', 'False': 'false', 'None': 'null'}
+_CONTROL_ESCAPES = {'\n': '\\n', '\t': '\\t', '\r': '\\r'}
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+def repair_json(text):
+    """
+    Parse the first JSON object in a model response, repairing common mistakes.
+
+    The text is scanned once, left to right: code fences and text around the
+    object are ignored, and missing or trailing commas, missing colons,
+    comments, unquoted or single-quoted strings, raw newlines and stray quotes
+    inside strings, mismatched brackets and a truncated end are fixed as they
+    are met. Returns (value, repairs), where repairs lists what was changed in
+    the object itself; value is None if no object could be recovered.
+    """
+    start = text.find('{')
+    if start < 0:
+        return None, ['no JSON object found']
+
+    repairs = []
+
+    def note(message):
+        if message not in repairs:
+            repairs.append(message)
+
+    # Fast path: the object is already valid JSON
+    decoder = json.JSONDecoder()
+    try:
+        value, _ = decoder.raw_decode(text, start)
+        return value, repairs
+    except ValueError:
+        pass
+
+    out = []
+    stack = []
+    # Role of the last token: 'open', 'key', 'colon', 'value' or 'comma'
+    prev = 'open'
+    last_comma = -1
+    n = len(text)
+    i = start
+
+    def begin_value():
+        # Insert a missing comma or colon before a token and record its role
+        nonlocal prev, last_comma
+        in_object = stack and stack[-1] == '{'
+        if prev == 'value':
+            last_comma = len(out)
+            out.append(',')
+            note('inserted missing comma')
+            prev = 'comma'
+        if in_object and prev in ('open', 'comma'):
+            prev = 'key'
+            return
+        if in_object and prev == 'key':
+            out.append(':')
+            note('inserted missing colon')
+        prev = 'value'
+
+    while i < n:
+        m = _TOKEN.match(text, i)
+        if m is None:
+            break
+        kind = m.lastgroup
+        if kind == 'value':
+            begin_value()
+            out.append(m.group(kind))
+            i = m.end()
+            continue
+        if kind == 'key':
+            begin_value()
+            out.append(m.group(kind))
+            if prev == 'key':
+                out.append(':')
+                prev = 'colon'
+            else:
+                note('dropped stray colon')
+            i = m.end()
+            continue
+        i = m.start('other')
+        c = text[i]
+        if c == '"' or c == "'":
+            if not stack:
+                break
+            begin_value()
+            if c == "'":
+                note('converted single-quoted string')
+            out.append('"')
+            j = i + 1
+            closed = False
+            while j < n:
+                run = _STRING_RUN.match(text, j)
+                if run:
+                    out.append(run.group())
+                    j = run.end()
+                    continue
+                ch = text[j]
+                if ch == '\\':
+                    if c == "'" and text.startswith("\\'", j):
+                        out.append("'")
+                    else:
+                        out.append(text[j:j + 2])
+                    j += 2
+                elif ch == c:
+                    # A quote only ends the string if followed by structure, a new
+                    # line or the next string (which then gets the missing comma)
+                    k = _WHITESPACE.match(text, j + 1).end()
+                    if k >= n or text[k] in ',:]}"' or text[k] == c or '\n' in text[j + 1:k]:
+                        j += 1
+                        closed = True
+                        break
+                    out.append('\\"')
+                    note('escaped quote inside string')
+                    j += 1
+                elif ch == '"' or ch == "'":
+                    out.append('\\"' if ch == '"' else ch)
+                    j += 1
+                else:
+                    out.append(_CONTROL_ESCAPES.get(ch, '\\u%04x' % ord(ch)))
+                    note('escaped control character in string')
+                    j += 1
+            if not closed:
+                note('closed unterminated string')
+            out.append('"')
+            i = j
+        elif c == '{' or c == '[':
+            if stack:
+                begin_value()
+            out.append(c)
+            stack.append(c)
+            prev = 'open'
+            i += 1
+        elif c == '}' or c == ']':
+            i += 1
+            opener = '{' if c == '}' else '['
+            if opener not in stack:
+                note('dropped stray closing bracket')
+                continue
+            if prev == 'comma':
+                out[last_comma] = ''
+                note('removed trailing comma')
+            elif prev == 'key':
+                out.append(':null')
+                note('added missing value')
+            elif prev == 'colon':
+                out.append('null')
+                note('added missing value')
+            while stack[-1] != opener:
+                out.append(_CLOSERS[stack.pop()])
+                note('closed unclosed bracket')
+            stack.pop()
+            out.append(c)
+            prev = 'value'
+            if not stack:
+                break
+        elif c == ',':
+            if prev in ('value', 'colon'):
+                if prev == 'colon':
+                    out.append('null')
+                    note('added missing value')
+                last_comma = len(out)
+                out.append(',')
+                prev = 'comma'
+            else:
+                note('removed extra comma')
+            i += 1
+        elif c == ':':
+            if prev == 'key':
+                out.append(':')
+                prev = 'colon'
+            else:
+                note('dropped stray colon')
+            i += 1
+        elif c == '#' or text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end < 0 else end
+            note('removed comment')
+        else:
+            end = _BAREWORD.match(text, i).end()
+            word = text[i:end].strip()
+            i = max(end, i + 1)
+            if not word.strip('.'):
+                note('removed ellipsis')
+                continue
+            begin_value()
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+            elif _NUMBER.fullmatch(word):
+                out.append(word)
+            else:
+                out.append(json.dumps(word))
+                note('quoted bare word')
+
+    if stack:
+        if prev == 'comma':
+            out[last_comma] = ''
+        elif prev == 'key':
+            out.append(':null')
+        elif prev == 'colon':
+            out.append('null')
+        while stack:
+            out.append(_CLOSERS[stack.pop()])
+        note('closed truncated output')
+
+    try:
+        return json.loads(''.join(out)), repairs
+    except ValueError as e:
+        repairs.append(f'could not repair: {e}')
+        return None, repairs
+
+
+def parse_json(results_string):
+    """Parse the JSON object in a model response; returns {} if there is none."""
+    res_dict, repairs = repair_json(results_string)
+    if not isinstance(res_dict, dict):
+        print("No valid JSON object found in the response.")
+        return {}
+    if repairs:
+        print(f"JSON repaired: {'; '.join(repairs)}")
+    return res_dict